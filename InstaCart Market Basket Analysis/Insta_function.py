@@ -1,3 +1,6 @@
+import os
+
+import numpy as np
 import pandas as pd
 
 def auto_Complete(product_name, top_num = 3):
@@ -49,6 +52,83 @@ def auto_Complete(product_name, top_num = 3):
         print('Try again with these options')
 
 
+class RuleIndex:
+
+    '''
+    Lookup index over the association rules table (rules.pkl), built once:
+
+    for each antecedent (itemA) the row range of its rules sorted by confidenceAtoB and,
+    among its rules with lift > 1, sorted by lift; the same for each consequent (itemB)
+    with confidenceBtoA; and the set of items in any rule with lift > 1.
+
+    Ties keep the order of the rows in rules.pkl
+    '''
+
+    def __init__(self, rules):
+
+        high_lift = rules[rules.lift > 1]
+
+        self.ant_confidence = self._ranges(rules, 'itemA', 'itemB', 'confidenceAtoB')
+        self.con_confidence = self._ranges(rules, 'itemB', 'itemA', 'confidenceBtoA')
+        self.ant_lift = self._ranges(high_lift, 'itemA', 'itemB', 'lift')
+        self.con_lift = self._ranges(high_lift, 'itemB', 'itemA', 'lift')
+
+        self.association_items = set(high_lift.itemB.unique()) | set(high_lift.itemA.unique())
+
+    @staticmethod
+    def _ranges(rules, key, other, score):
+
+        '''
+        Sorts the rules by key, then score (high to low)
+
+        RETURN: (key -> (start, end) row range, the other item of each row, the score of each row)
+        '''
+
+        rules = rules.sort_values(by = score, ascending = False, kind = 'stable').sort_values(by = key, kind = 'stable')
+
+        keys = rules[key].to_numpy()
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.array([], int)
+        ends = np.append(starts[1:], len(keys))
+
+        ranges = {keys[start]: (start, end) for start, end in zip(starts, ends)}
+
+        return ranges, rules[other].to_numpy(), rules[score].to_numpy()
+
+    @staticmethod
+    def lookup(index, item, num = None):
+
+        '''
+        Returns (other items, scores) of the first num rules of item in one of the indexes
+        '''
+
+        ranges, others, scores = index
+        start, end = ranges.get(item, (0, 0))
+        if num is not None:
+            end = min(end, start + num)
+
+        return others[start:end], scores[start:end]
+
+
+# path -> ((mtime, size) of the pickle, RuleIndex)
+_rule_indexes = {}
+
+
+def get_rule_index(path = 'rules.pkl'):
+
+    '''
+    Returns the RuleIndex of the rules pickle, built on first use and rebuilt when the pickle changes
+    '''
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _rule_indexes.get(path)
+    if cached is None or cached[0] != signature:
+        cached = _rule_indexes[path] = (signature, RuleIndex(pd.read_pickle(path)))
+
+    return cached[1]
+
+
 def find_association(item_nameAnt = None, item_nameCon = None, num_association = 3):
     
     '''
@@ -66,22 +146,21 @@ def find_association(item_nameAnt = None, item_nameCon = None, num_association =
     ant_cond - the products associated with the consequent with decreasing confidence score
     
     It is possible that one or more of the outputs contains an empty list
+
+    The rules are looked up in the resident RuleIndex of rules.pkl (see get_rule_index)
     '''
 
-    rules = pd.read_pickle('rules.pkl')
-    association_df_a = rules[rules.itemA == item_nameAnt].sort_values(by = 'confidenceAtoB', ascending = False)
-    association_df_c = rules[rules.itemB == item_nameCon].sort_values(by = 'confidenceBtoA', ascending = False)
+    index = get_rule_index()
 
     # all the prodcuct item which has a lift greater than 1
-    association_items = set(list(rules[rules.lift > 1].itemB.unique()) + list(rules[rules.lift > 1].itemA.unique()))
+    association_items = index.association_items
 
     # check if the Ant item is a association item
     # if so, print the Con items with a lift > 1
     ant_association = []
     if item_nameAnt in association_items:
         print(f'You have found {item_nameAnt} to have high associations with: ')
-        high_lift = rules[rules.itemA == item_nameAnt].sort_values(by = 'lift', ascending = False)
-        for item in high_lift[high_lift.lift > 1].itemB:
+        for item in index.lookup(index.ant_lift, item_nameAnt)[0]:
             ant_association.append(item)
             print(item)
 
@@ -89,9 +168,9 @@ def find_association(item_nameAnt = None, item_nameCon = None, num_association =
     if item_nameAnt != None:
         print('\n\n')
         print(f'If they bought {item_nameAnt}, they will also buy:')
-        for index, item in enumerate(association_df_a.iloc[:num_association,1]):
+        for item, confidence in zip(*index.lookup(index.ant_confidence, item_nameAnt, num_association)):
             ant_cond.append(item)
-            print(f'{item}, {round(association_df_a.iloc[index,8],3)}')
+            print(f'{item}, {round(confidence,3)}')
 
 
     # check if the Con item is a association item
@@ -100,8 +179,7 @@ def find_association(item_nameAnt = None, item_nameCon = None, num_association =
     if item_nameCon in association_items:
         print('\n\n')
         print(f'You have found {item_nameCon} to have high associations with: ')
-        high_lift = rules[rules.itemB == item_nameCon].sort_values(by = 'lift', ascending = False)
-        for item in high_lift[high_lift.lift > 1].itemA:
+        for item in index.lookup(index.con_lift, item_nameCon)[0]:
             con_association.append(item)
             print(item)
 
@@ -109,9 +187,9 @@ def find_association(item_nameAnt = None, item_nameCon = None, num_association =
     if item_nameCon != None:
         print('\n\n')
         print(f'These are the products they will buy before purchasing {item_nameCon}:')
-        for index, item in enumerate(association_df_c.iloc[:num_association,0]):
+        for item, confidence in zip(*index.lookup(index.con_confidence, item_nameCon, num_association)):
             con_cond.append(item)
-            print(f'{item}, {round(association_df_c.iloc[index,9],3)}')
+            print(f'{item}, {round(confidence,3)}')
 
 
     return (ant_association, ant_cond, con_association, con_cond)
@@ -0,0 +1,694 @@
+from itertools import combinations, groupby
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+
+# Returns frequency counts for items and item pairs
+def freq(iterable):
+    if type(iterable) == pd.core.series.Series:
+        return iterable.value_counts().rename("freq")
+    else:
+        return pd.Series(Counter(iterable)).rename("freq")
+
+
+# Returns number of unique orders
+def order_count(order_item):
+    return len(set(order_item.index))
+
+
+# Returns generator that yields item pairs, one at a time
+def get_item_pairs(order_item):
+    order_item = order_item.reset_index().to_numpy()
+    for order_id, order_object in groupby(order_item, lambda x: x[0]):
+        item_list = [item[1] for item in order_object]
+
+        for item_pair in combinations(item_list, 2):
+            yield item_pair
+
+
+# Returns frequency and support associated with item
+def merge_item_stats(item_pairs, item_stats):
+    return (item_pairs
+                .merge(item_stats.rename(columns={'freq': 'freqA', 'support': 'supportA'}), left_on='item_A', right_index=True)
+                .merge(item_stats.rename(columns={'freq': 'freqB', 'support': 'supportB'}), left_on='item_B', right_index=True))
+
+
+# Returns name associated with item
+def merge_item_name(rules, item_name):
+    columns = ['itemA','itemB','freqAB','supportAB','freqA','supportA','freqB','supportB',
+               'confidenceAtoB','confidenceBtoA','lift']
+    rules = (rules
+                .merge(item_name.rename(columns={'item_name': 'itemA'}), left_on='item_A', right_on='item_id')
+                .merge(item_name.rename(columns={'item_name': 'itemB'}), left_on='item_B', right_on='item_id'))
+    return rules[columns]
+
+
+def encode_orders(order_item):
+
+    '''
+    INPUT: a Series of item ids indexed by order_id, the rows of each order next to each other
+
+    OUTPUT: (indptr, indices, item_ids), the orders as the rows of a CSR order x item matrix:
+    the items of order i are indices[indptr[i]:indptr[i + 1]] (int32 positions into the
+    sorted array item_ids), in the order they appear in order_item
+    '''
+
+    item_ids, indices = np.unique(order_item.to_numpy(), return_inverse = True)
+
+    return order_indptr(order_item.index.to_numpy()), indices.astype(np.int32), item_ids
+
+
+def order_indptr(order_ids):
+
+    '''
+    Returns the offsets of the orders in an array of order ids: an order starts
+    wherever the order_id changes, the same runs itertools.groupby sees
+    '''
+
+    starts = np.flatnonzero(order_ids[1:] != order_ids[:-1]) + 1
+
+    return np.concatenate([[0], starts, [len(order_ids)]]).astype(np.int64)
+
+
+def order_pair_counts(indptr):
+
+    '''
+    Number of item pairs, L * (L - 1) / 2, of each order of length L
+    '''
+
+    lengths = np.diff(indptr)
+    return lengths * (lengths - 1) // 2
+
+
+def order_pairs(indptr, indices):
+
+    '''
+    Returns (first, second) item indices of every 2-combination of every order,
+    in the same order as get_item_pairs yields them
+    '''
+
+    position = np.arange(indptr[0], indptr[-1])
+    # number of items after each item in its own order
+    following = np.repeat(indptr[1:], np.diff(indptr)) - position - 1
+
+    first = np.repeat(position, following)
+    run_start = np.repeat(np.cumsum(following) - following, following)
+    second = first + 1 + np.arange(len(first)) - run_start
+
+    return indices[first], indices[second]
+
+
+class PairCounter:
+
+    '''
+    Counts pair keys (int64) with np.unique and keeps, next to each count,
+    the position of the pair's first occurrence, so the pairs can be put back in the
+    order a Counter fed the same pairs would list them.
+
+    Batches are counted on their own and merged into the totals once they add up to as
+    many keys as the totals hold, so each key is re-sorted O(log # of batches) times
+    '''
+
+    def __init__(self):
+
+        self.keys = np.empty(0, np.int64)
+        self.counts = np.empty(0, np.int64)
+        self.first = np.empty(0, np.int64)
+
+        self._pending = []
+        self._pending_size = 0
+
+    def update(self, keys, offset = 0):
+
+        '''
+        Adds a batch of pair keys; offset is the position of the batch's first pair
+        in the whole stream of pairs, or an array of the position of every pair
+        '''
+
+        keys, first, counts = np.unique(keys, return_index = True, return_counts = True)
+        self._add(keys, counts, offset[first] if np.ndim(offset) else first + offset)
+
+    def merge(self, other):
+
+        other._compact()
+        self._add(other.keys, other.counts, other.first)
+
+        return self
+
+    def _add(self, keys, counts, first):
+
+        self._pending.append((keys, counts.astype(np.int64), first.astype(np.int64)))
+        self._pending_size += len(keys)
+
+        if self._pending_size >= max(len(self.keys), 1 << 20):
+            self._compact()
+
+    def _compact(self):
+
+        if not self._pending:
+            return
+
+        keys, counts, first = (np.concatenate([total] + [batch[i] for batch in self._pending])
+                               for i, total in enumerate([self.keys, self.counts, self.first]))
+        self._pending = []
+        self._pending_size = 0
+
+        order = np.argsort(keys, kind = 'stable')
+        keys = keys[order]
+        boundaries = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+
+        self.keys = keys[boundaries]
+        self.counts = np.add.reduceat(counts[order], boundaries)
+        self.first = np.minimum.reduceat(first[order], boundaries)
+
+    def result(self):
+
+        '''
+        Returns (keys, counts), in order of first occurrence
+        '''
+
+        self._compact()
+        order = np.argsort(self.first)
+
+        return self.keys[order], self.counts[order]
+
+
+def count_pairs(indptr, indices, n_items, counter = None, offset = 0, chunk_pairs = 5000000, pair_starts = None):
+
+    '''
+    Counts the item pairs of the encoded orders into a PairCounter, pair (a, b) as the
+    int64 key a * n_items + b, generating at most about chunk_pairs pairs at a time.
+    offset is the position of the first pair of these orders in the whole stream of pairs;
+    when the orders are not consecutive (a shard), pair_starts gives the position
+    of the first pair of each order instead
+
+    RETURN: the PairCounter
+    '''
+
+    counter = counter or PairCounter()
+
+    pairs = order_pair_counts(indptr)
+    pair_end = np.cumsum(pairs)
+    start = 0
+    while start < len(indptr) - 1:
+        done = pair_end[start - 1] if start else 0
+        # a single order with more than chunk_pairs pairs gets a chunk of its own
+        stop = max(int(np.searchsorted(pair_end, done + chunk_pairs, side = 'right')), start + 1)
+
+        first, second = order_pairs(indptr[start:stop + 1], indices)
+        keys = first.astype(np.int64) * n_items + second
+
+        if pair_starts is None:
+            counter.update(keys, offset)
+            offset += len(first)
+        else:
+            chunk_pairs_start = pair_end[start:stop] - pairs[start:stop] - done
+            counter.update(keys, np.repeat(pair_starts[start:stop] - chunk_pairs_start, pairs[start:stop])
+                                 + np.arange(len(keys)))
+        start = stop
+
+    return counter
+
+
+def _count_shard(indptr, indices, n_items, pair_starts):
+
+    counter = count_pairs(indptr, indices, n_items, pair_starts = pair_starts)
+    counter._compact()
+
+    return counter
+
+
+def _merge_counters(counter, other):
+
+    counter.merge(other)
+    counter._compact()
+
+    return counter
+
+
+def count_pairs_sharded(indptr, indices, n_items, order_ids, processes = None, shards = None):
+
+    '''
+    Counts the item pairs of the encoded orders across a process pool.
+
+    The orders are partitioned by a hash of their order_id (order_ids holds the id of each order)
+    into shards, by default one per process. Each worker counts the pairs of a shard into its own
+    PairCounter, keeping the position every pair has in the single-process stream, and the partial
+    counters are merged pairwise in the pool, a tree of log2(shards) rounds.
+    The result is the same PairCounter count_pairs returns
+
+    RETURN: the PairCounter
+    '''
+
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = processes or os.cpu_count()
+    shards = shards or processes
+
+    lengths = np.diff(indptr)
+    pairs = order_pair_counts(indptr)
+    pair_starts = np.cumsum(pairs) - pairs
+
+    # Fibonacci hashing, so runs of consecutive order ids spread over all shards
+    order_shard = (order_ids.astype(np.uint64) * np.uint64(11400714819323198485) >> np.uint64(40)) % np.uint64(shards)
+    row_shard = np.repeat(order_shard, lengths)
+
+    with ProcessPoolExecutor(processes) as pool:
+        counters = []
+        for shard in range(shards):
+            in_shard = order_shard == shard
+            shard_indptr = np.concatenate([[0], np.cumsum(lengths[in_shard])])
+            counters.append(pool.submit(_count_shard, shard_indptr, indices[row_shard == shard],
+                                        n_items, pair_starts[in_shard]))
+        counters = [counter.result() for counter in counters]
+
+        # tree reduce
+        while len(counters) > 1:
+            merged = [pool.submit(_merge_counters, counters[i], counters[i + 1])
+                      for i in range(0, len(counters) - 1, 2)]
+            counters = [counter.result() for counter in merged] + counters[len(merged) * 2:]
+
+    return counters[0]
+
+
+def pair_frequency(counter, item_ids):
+
+    '''
+    Turns the counted keys into the item_pairs table of association_rules:
+    item_A, item_B and freqAB, in the order the Counter of get_item_pairs would list them
+    '''
+
+    keys, counts = counter.result()
+    n_items = len(item_ids)
+
+    return pd.DataFrame({'item_A': item_ids[keys // n_items],
+                         'item_B': item_ids[keys % n_items],
+                         'freqAB': counts})
+
+
+def filter_order_items(order_item, min_support):
+
+    '''
+    Drops the items with support < min_support, then the orders left with less than 2 items
+
+    RETURN: (the remaining order_item, their item frequency and support, the number of remaining orders)
+    '''
+
+    print("Starting order_item: {:22d}".format(len(order_item)))
+
+
+    # Calculate item frequency and support
+    item_stats             = freq(order_item).to_frame("freq")
+    item_stats['support']  = item_stats['freq'] / order_count(order_item) * 100
+
+
+    # Filter from order_item items below min support
+    qualifying_items       = item_stats[item_stats['support'] >= min_support].index
+    order_item             = order_item[order_item.isin(qualifying_items)]
+
+    print("Items with support >= {}: {:15d}".format(min_support, len(qualifying_items)))
+    print("Remaining order_item: {:21d}".format(len(order_item)))
+
+
+    # Filter from order_item orders with less than 2 items
+    order_size             = freq(order_item.index)
+    qualifying_orders      = order_size[order_size >= 2].index
+    order_item             = order_item[order_item.index.isin(qualifying_orders)]
+
+    print("Remaining orders with 2+ items: {:11d}".format(len(qualifying_orders)))
+    print("Remaining order_item: {:21d}".format(len(order_item)))
+
+
+    # Recalculate item frequency and support
+    item_stats             = freq(order_item).to_frame("freq")
+    item_stats['support']  = item_stats['freq'] / order_count(order_item) * 100
+
+    return order_item, item_stats, len(qualifying_orders)
+
+
+def association_rules(order_item, min_support, engine = 'numpy', processes = None):
+
+    '''
+    INPUT: a Series of item ids indexed by order_id, the minimum support (in percent)
+
+    OUTPUT: the association rules of every item pair with support >= min_support, sorted by lift
+
+    engine = 'numpy' counts the pairs of the CSR encoded orders as int64 keys with np.unique,
+    engine = 'counter' feeds the get_item_pairs generator into a Counter; both return the same table.
+    With processes > 1 the numpy engine counts shards of the orders in that many processes
+    (count_pairs_sharded), again with the same result
+    '''
+
+    order_item, item_stats, num_orders = filter_order_items(order_item, min_support)
+
+
+    # Calculate item pair frequency
+    if engine == 'numpy':
+        indptr, indices, item_ids = encode_orders(order_item)
+        if processes and processes > 1:
+            counter = count_pairs_sharded(indptr, indices, len(item_ids), order_item.index.to_numpy()[indptr[:-1]],
+                                          processes)
+        else:
+            counter = count_pairs(indptr, indices, len(item_ids))
+        item_pairs = pair_frequency(counter, item_ids)
+    elif engine == 'counter':
+        item_pairs = freq(get_item_pairs(order_item)).to_frame("freqAB")
+        item_pairs = item_pairs.reset_index().rename(columns={'level_0': 'item_A', 'level_1': 'item_B'})
+    else:
+        raise ValueError(f"engine must be 'numpy' or 'counter', not {engine!r}")
+
+    return rules_table(item_pairs, item_stats, num_orders, min_support)
+
+
+def rules_table(item_pairs, item_stats, num_orders, min_support):
+
+    '''
+    Computes the support of the counted item pairs, keeps those with support >= min_support
+    and adds the frequency, support, confidence and lift columns of the rules
+    '''
+
+    item_pairs['supportAB'] = item_pairs['freqAB'] / num_orders * 100
+
+    print("Item pairs: {:31d}".format(len(item_pairs)))
+
+
+    # Filter from item_pairs those below min support
+    item_pairs              = item_pairs[item_pairs['supportAB'] >= min_support]
+
+    print("Item pairs with support >= {}: {:10d}\n".format(min_support, len(item_pairs)))
+
+
+    # Create table of association rules and compute relevant metrics
+    item_pairs = item_pairs.reset_index(drop=True)
+    item_pairs = merge_item_stats(item_pairs, item_stats)
+
+    item_pairs['confidenceAtoB'] = item_pairs['supportAB'] / item_pairs['supportA']
+    item_pairs['confidenceBtoA'] = item_pairs['supportAB'] / item_pairs['supportB']
+    item_pairs['lift']           = item_pairs['supportAB'] / (item_pairs['supportA'] * item_pairs['supportB'])
+
+
+    # Return association rules sorted by lift in descending order
+    return item_pairs.sort_values('lift', ascending=False)
+
+
+def read_order_chunks(path, chunksize = 1000000):
+
+    '''
+    Reads the order_id and product_id columns of an order_products csv as int32,
+    chunksize rows at a time, and yields DataFrames that each hold whole orders
+    (the rows of the last order of a chunk are carried over to the next one).
+    The rows of each order must be next to each other, as they are in the InstaCart files
+    '''
+
+    columns = ['order_id', 'product_id']
+    carry = None
+
+    for chunk in pd.read_csv(path, usecols = columns, dtype = {column: np.int32 for column in columns},
+                             chunksize = chunksize):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index = True)
+
+        order_ids = chunk['order_id'].to_numpy()
+        other = np.flatnonzero(order_ids != order_ids[-1])
+        last_order = other[-1] + 1 if len(other) else 0
+
+        carry = chunk.iloc[last_order:]
+        if last_order:
+            yield chunk.iloc[:last_order]
+
+    if carry is not None and len(carry):
+        yield carry
+
+
+def _add_counts(total, values):
+
+    # bincount into a growing array
+    counts = np.bincount(values)
+    if len(counts) > len(total):
+        total = np.concatenate([total, np.zeros(len(counts) - len(total), np.int64)])
+    total[:len(counts)] += counts
+
+    return total
+
+
+def association_rules_csv(path, min_support, chunksize = 1000000):
+
+    '''
+    INPUT: the path of order_products__prior.csv (or any csv with order_id and product_id columns,
+    the rows of each order next to each other), the minimum support (in percent)
+
+    OUTPUT: the same table as association_rules(order_item, min_support)
+
+    Out-of-core version of association_rules: the csv is streamed twice in chunks of whole orders.
+    The first pass counts the items and orders for the min_support item filter, the second applies
+    the item filter and the 2+ items order filter to each chunk and adds its pairs to one PairCounter.
+    Memory holds a chunk, the item counts and the counted pairs, never the whole order table
+    '''
+
+    # first pass: item frequency and number of orders
+    item_freq = np.zeros(0, np.int64)
+    seen_orders = np.zeros(0, bool)
+    num_rows = 0
+
+    for chunk in read_order_chunks(path, chunksize):
+        order_ids = chunk['order_id'].to_numpy()
+        if order_ids.max() >= len(seen_orders):
+            seen_orders = np.concatenate([seen_orders, np.zeros(order_ids.max() + 1 - len(seen_orders), bool)])
+        seen_orders[order_ids] = True
+
+        item_freq = _add_counts(item_freq, chunk['product_id'].to_numpy())
+        num_rows += len(chunk)
+
+    print("Starting order_item: {:22d}".format(num_rows))
+
+
+    # Filter items below min support
+    support = item_freq / int(seen_orders.sum()) * 100
+    qualifying_items = np.flatnonzero((support >= min_support) & (item_freq > 0))
+
+    # position of each qualifying item, -1 for the others
+    item_lookup = np.full(len(item_freq), -1, np.int32)
+    item_lookup[qualifying_items] = np.arange(len(qualifying_items), dtype = np.int32)
+
+    print("Items with support >= {}: {:15d}".format(min_support, len(qualifying_items)))
+
+
+    # second pass: filters and pair counts, chunk by chunk
+    counter = PairCounter()
+    pair_offset = 0
+    filtered_freq = np.zeros(0, np.int64)
+    remaining_rows = 0
+    num_orders = 0
+    num_items = 0
+
+    for chunk in read_order_chunks(path, chunksize):
+        order_ids = chunk['order_id'].to_numpy()
+        indices = item_lookup[chunk['product_id'].to_numpy()]
+
+        keep = indices >= 0
+        order_ids, indices = order_ids[keep], indices[keep]
+        remaining_rows += len(indices)
+        if len(indices) == 0:
+            continue
+
+        # Filter orders with less than 2 items
+        indptr = order_indptr(order_ids)
+        lengths = np.diff(indptr)
+        keep = np.repeat(lengths >= 2, lengths)
+        indices = indices[keep]
+        indptr = np.concatenate([[0], np.cumsum(lengths[lengths >= 2])])
+
+        num_orders += len(indptr) - 1
+        num_items += len(indices)
+        filtered_freq = _add_counts(filtered_freq, indices)
+
+        count_pairs(indptr, indices, len(qualifying_items), counter, pair_offset)
+        pair_offset += int(order_pair_counts(indptr).sum())
+
+    print("Remaining order_item: {:21d}".format(remaining_rows))
+    print("Remaining orders with 2+ items: {:11d}".format(num_orders))
+    print("Remaining order_item: {:21d}".format(num_items))
+
+
+    # Recalculate item frequency and support
+    item_ids = qualifying_items.astype(np.int64)
+    present = np.flatnonzero(filtered_freq)
+    item_stats = pd.DataFrame({'freq': filtered_freq[present]}, index = pd.Index(item_ids[present], name = 'item_id'))
+    item_stats['support'] = item_stats['freq'] / num_orders * 100
+
+    item_pairs = pair_frequency(counter, item_ids)
+
+    return rules_table(item_pairs, item_stats, num_orders, min_support)
+
+
+def item_tidlists(indptr, indices, n_items):
+
+    '''
+    Vertical layout of the encoded orders: the sorted positions of the orders holding each item,
+    returned as (order positions grouped by item, offset of each item's group)
+    '''
+
+    order_position = np.repeat(np.arange(len(indptr) - 1, dtype = np.int32), np.diff(indptr))
+    by_item = np.argsort(indices, kind = 'stable')
+
+    return order_position[by_item], np.concatenate([[0], np.cumsum(np.bincount(indices, minlength = n_items))])
+
+
+def intersect_sorted(a, b):
+
+    '''
+    Intersection of two sorted arrays of unique order positions
+    '''
+
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+
+    found = np.minimum(np.searchsorted(b, a), len(b) - 1)
+
+    return a[b[found] == a]
+
+
+def unordered_pair_counts(counter, n_items, min_count = 1):
+
+    '''
+    Adds up the counts of (a, b) and (b, a) of a PairCounter
+
+    RETURN: a dict of (smaller item index, larger item index) -> number of orders holding both,
+    for the pairs held by at least min_count orders
+    '''
+
+    keys, counts = counter.result()
+    first, second = keys // n_items, keys % n_items
+    low, high = np.minimum(first, second), np.maximum(first, second)
+
+    keys, inverse = np.unique(low * n_items + high, return_inverse = True)
+    counts = np.bincount(inverse, weights = counts).astype(np.int64)
+
+    # only the frequent pairs make it into the dict
+    keep = (counts >= min_count) & (keys // n_items != keys % n_items)
+    keys, counts = keys[keep], counts[keep]
+
+    return {(int(key // n_items), int(key % n_items)): int(count)
+            for key, count in zip(keys.tolist(), counts.tolist())}
+
+
+def eclat(indptr, indices, n_items, pair_counts, min_count, max_size = 3):
+
+    '''
+    Depth-first Eclat over the order tidlists of the items, for itemsets of 3 to max_size items.
+
+    Mining starts from the frequent pairs (pair_counts, a dict of item index pair -> count),
+    and an itemset is only extended by an item that forms a frequent pair with its last item,
+    so the tidlist intersections are limited to candidates whose 2-item subsets are all frequent
+    along the prefix. Only the tidlists of the current prefix path are held in memory
+
+    RETURN: a dict of itemset (sorted tuple of item indices) -> number of orders holding it
+    '''
+
+    tids, offsets = item_tidlists(indptr, indices, n_items)
+
+    frequent_pairs = {}
+    for (a, b), count in pair_counts.items():
+        if count >= min_count:
+            frequent_pairs.setdefault(a, []).append(b)
+
+    itemsets = {}
+
+    def extend(prefix, extensions):
+
+        # extensions: (item, tidlist of prefix + item) of the frequent extensions of prefix, by item
+        for i, (item, item_tids) in enumerate(extensions):
+            itemset = prefix + (item,)
+            if len(itemset) >= 3:
+                itemsets[itemset] = len(item_tids)
+            if len(itemset) == max_size:
+                continue
+
+            partners = set(frequent_pairs.get(item, ()))
+            next_extensions = []
+            for other, other_tids in extensions[i + 1:]:
+                if other in partners:
+                    both = intersect_sorted(item_tids, other_tids)
+                    if len(both) >= min_count:
+                        next_extensions.append((other, both))
+
+            if next_extensions:
+                extend(itemset, next_extensions)
+
+    for a in sorted(frequent_pairs):
+        a_tids = tids[offsets[a]:offsets[a + 1]]
+        extensions = [(b, intersect_sorted(a_tids, tids[offsets[b]:offsets[b + 1]]))
+                      for b in sorted(frequent_pairs[a])]
+        extend((a,), extensions)
+
+    return itemsets
+
+
+def association_rules_itemsets(order_item, min_support, max_size = 3):
+
+    '''
+    INPUT: a Series of item ids indexed by order_id, the minimum support (in percent),
+    the largest itemset to mine
+
+    OUTPUT: the association rules of the itemsets of 3 to max_size items with support >= min_support,
+    sorted by lift, in the same columns as association_rules: for every frequent itemset and every
+    item of it, item_A is the tuple of the other items (the antecedent) and item_B the item
+
+    The orders go through the same filters as in association_rules. The frequent pairs are counted
+    with count_pairs, the larger itemsets mined with eclat
+    '''
+
+    order_item, item_stats, num_orders = filter_order_items(order_item, min_support)
+
+    # the smallest count whose support is >= min_support, by the same formula as the supports
+    min_count = int(np.ceil(min_support * num_orders / 100))
+    while min_count > 0 and (min_count - 1) / num_orders * 100 >= min_support:
+        min_count -= 1
+    while min_count / num_orders * 100 < min_support:
+        min_count += 1
+
+    indptr, indices, item_ids = encode_orders(order_item)
+    pair_counts = unordered_pair_counts(count_pairs(indptr, indices, len(item_ids)), len(item_ids), min_count)
+
+    itemsets = eclat(indptr, indices, len(item_ids), pair_counts, min_count, max_size)
+
+    print("Itemsets of 3+ items with support >= {}: {:d}\n".format(min_support, len(itemsets)))
+
+    rules = []
+    for itemset, count in itemsets.items():
+        for consequent in itemset:
+            # every antecedent of a frequent itemset is frequent, so it is one of the pairs or itemsets
+            antecedent = tuple(item for item in itemset if item != consequent)
+            freq_antecedent = pair_counts[antecedent] if len(antecedent) == 2 else itemsets[antecedent]
+            rules.append((tuple(int(item_ids[item]) for item in antecedent), item_ids[consequent],
+                          count, freq_antecedent))
+
+    rules = pd.DataFrame(rules, columns = ['item_A', 'item_B', 'freqAB', 'freqA'])
+    rules['item_B'] = rules['item_B'].astype(item_ids.dtype)
+    rules['supportAB'] = rules['freqAB'] / num_orders * 100
+    rules['supportA'] = rules['freqA'] / num_orders * 100
+    rules = rules.merge(item_stats.rename(columns={'freq': 'freqB', 'support': 'supportB'}), left_on='item_B', right_index=True)
+
+    rules['confidenceAtoB'] = rules['supportAB'] / rules['supportA']
+    rules['confidenceBtoA'] = rules['supportAB'] / rules['supportB']
+    rules['lift']           = rules['supportAB'] / (rules['supportA'] * rules['supportB'])
+
+    columns = ['item_A','item_B','freqAB','supportAB','freqA','supportA','freqB','supportB',
+               'confidenceAtoB','confidenceBtoA','lift']
+
+    return rules[columns].sort_values('lift', ascending=False)
+
+
+# Returns names associated with the items of itemset rules, the antecedent items joined with ' + '
+def merge_itemset_name(rules, item_name):
+    names = item_name.set_index('item_id')['item_name']
+    rules = rules.assign(itemA = [' + '.join(names[item] for item in items) for items in rules['item_A']],
+                         itemB = names.reindex(rules['item_B']).to_numpy())
+    columns = ['itemA','itemB','freqAB','supportAB','freqA','supportA','freqB','supportB',
+               'confidenceAtoB','confidenceBtoA','lift']
+    return rules[columns]
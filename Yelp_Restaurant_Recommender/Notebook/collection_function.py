@@ -0,0 +1,183 @@
+import os
+from itertools import groupby
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# business fields exported next to the reviews (nested fields such as hours/attributes are left out)
+BUSINESS_FIELDS = ['business_id', 'name', 'address', 'city', 'state', 'postal_code',
+                   'latitude', 'longitude', 'stars', 'review_count', 'is_open', 'categories']
+
+# Arrow types of the exported columns, any other field is written as a string
+FIELD_TYPES = {'latitude': pa.float64(),
+               'longitude': pa.float64(),
+               'stars': pa.float64(),
+               'review_count': pa.int64(),
+               'is_open': pa.int64(),
+               'text': pa.large_string()}
+
+
+def export_schema(fields, partition_col = 'city'):
+
+    '''
+    One Arrow schema for every exported file, so a file whose column is all None (a small city
+    without categories, businesses without reviews) or whose stars are all whole numbers
+    still reads back together with the others
+    '''
+
+    return pa.schema([(field, FIELD_TYPES.get(field, pa.string())) for field in fields if field != partition_col])
+
+
+def row_bytes(row):
+
+    # rough in-memory size of a row, dominated by the joined review text
+    return sum(len(value) if isinstance(value, str) else 8 for value in row.values())
+
+
+class PartitionedWriter:
+
+    '''
+    Buffers rows per city and writes them out as Parquet files,
+    out_dir/city=<city>/part-00000.parquet, part-00001.parquet, ...
+    every rows_per_file rows. Across all cities at most max_buffer_bytes (roughly, by row_bytes)
+    sit in memory: past it the largest buffer is written out early.
+    As in hive partitioning the city is only in the folder name, not a column of the files,
+    so pd.read_parquet(out_dir) reads it back from the folders. Every file is written with
+    the same schema (export_schema of fields)
+    '''
+
+    def __init__(self, out_dir, rows_per_file = 5000, partition_col = 'city', fields = BUSINESS_FIELDS + ['text'],
+                 max_buffer_bytes = 256 * 2 ** 20):
+
+        self.out_dir = out_dir
+        self.rows_per_file = rows_per_file
+        self.partition_col = partition_col
+        self.schema = export_schema(fields, partition_col)
+        self.max_buffer_bytes = max_buffer_bytes
+
+        self._buffers = {}
+        self._sizes = {}
+        self._buffered_bytes = 0
+        self._parts = {}
+        self.paths = []
+
+    def add(self, row):
+
+        partition = row.get(self.partition_col) or 'unknown'
+        buffer = self._buffers.setdefault(partition, [])
+        buffer.append(row)
+
+        size = row_bytes(row)
+        self._sizes[partition] = self._sizes.get(partition, 0) + size
+        self._buffered_bytes += size
+
+        if len(buffer) >= self.rows_per_file:
+            self.flush(partition)
+
+        while self._buffered_bytes > self.max_buffer_bytes:
+            self.flush(max(self._sizes, key = self._sizes.get))
+
+    def flush(self, partition):
+
+        buffer = self._buffers.pop(partition, None)
+        self._buffered_bytes -= self._sizes.pop(partition, 0)
+        if not buffer:
+            return
+
+        # city names are used as folder names
+        folder = os.path.join(self.out_dir, f'{self.partition_col}={partition.replace(os.sep, "_")}')
+        os.makedirs(folder, exist_ok = True)
+
+        part = self._parts.get(partition, 0)
+        self._parts[partition] = part + 1
+
+        path = os.path.join(folder, f'part-{part:05d}.parquet')
+        # fields missing from a row are written as null, fields outside the schema (the city) are left out
+        pq.write_table(pa.Table.from_pylist(buffer, schema = self.schema), path)
+        self.paths.append(path)
+
+    def close(self):
+
+        for partition in list(self._buffers):
+            self.flush(partition)
+
+        return self.paths
+
+
+def group_reviews(review_cursor):
+
+    '''
+    INPUT: a cursor of reviews sorted by business_id
+
+    OUTPUT: yields (business_id, list of review texts) one business at a time
+    '''
+
+    for business_id, reviews in groupby(review_cursor, key = lambda review: review['business_id']):
+        yield business_id, [review['text'] for review in reviews]
+
+
+def export_yelp(yelp_db, out_dir, business_fields = BUSINESS_FIELDS, batch_size = 10000,
+                rows_per_file = 5000, separator = '@@@@', create_index = True, max_buffer_bytes = 256 * 2 ** 20):
+
+    '''
+    Streams the Yelp business and review collections out of MongoDB into Parquet files
+    partitioned by city, one row per business with all its reviews joined by separator
+    (the same table as yelp_df in Data_Collection.ipynb).
+
+    Reviews are read in batches of batch_size, sorted by business_id, so only the reviews of one
+    business are aggregated at a time; besides the projected business fields at most
+    max_buffer_bytes of rows wait in memory to be written (see PartitionedWriter).
+    Businesses without reviews are written with text = None.
+
+    RETURN: the list of Parquet files written
+    '''
+
+    projection = {'_id': 0}
+    projection.update({field: 1 for field in business_fields})
+    businesses = {business['business_id']: business
+                  for business in yelp_db.business.find({}, projection).batch_size(batch_size)}
+
+    # the sort streams off the index instead of sorting the whole collection in memory
+    if create_index:
+        yelp_db.review.create_index('business_id')
+
+    review_cursor = (yelp_db.review
+                     .find({}, {'_id': 0, 'business_id': 1, 'text': 1})
+                     .sort('business_id', 1)
+                     .batch_size(batch_size))
+
+    writer = PartitionedWriter(out_dir, rows_per_file, fields = list(business_fields) + ['text'],
+                               max_buffer_bytes = max_buffer_bytes)
+
+    for business_id, texts in group_reviews(review_cursor):
+        business = businesses.pop(business_id, None)
+        # reviews of businesses missing from the business collection are dropped, as in the join
+        if business is not None:
+            business['text'] = separator.join(texts)
+            writer.add(business)
+
+    for business in businesses.values():
+        business['text'] = None
+        writer.add(business)
+
+    return writer.close()
+
+
+def read_city(out_dir, city, columns = None):
+
+    '''
+    Reads the exported rows of a single city back into a DataFrame (with its city column)
+    '''
+
+    # the city is only in the folder name, so it is added back rather than read
+    file_columns = None if columns is None else [column for column in columns if column != 'city']
+
+    city_df = pd.read_parquet(os.path.join(out_dir, f'city={city.replace(os.sep, "_")}'), columns = file_columns)
+    if columns is None or 'city' in columns:
+        city_df['city'] = city
+        if columns is not None:
+            city_df = city_df[list(columns)]
+
+    return city_df
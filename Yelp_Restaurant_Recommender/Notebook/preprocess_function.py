@@ -0,0 +1,220 @@
+import os
+import json
+from itertools import count, islice
+
+
+# per-process lemmatizer, stemmer and token -> stem memo, set up by _init_worker;
+# the memo is bounded to STEM_CACHE_SIZE entries like help_function.TOKEN_CACHE_SIZE
+STEM_CACHE_SIZE = 50000
+_lemmatizer = None
+_stemmer = None
+_stem_cache = {}
+
+
+def _init_worker():
+
+    global _lemmatizer, _stemmer
+
+    from nltk.stem import WordNetLemmatizer, PorterStemmer
+
+    _lemmatizer = WordNetLemmatizer()
+    _stemmer = PorterStemmer()
+
+
+def preprocess_review(review):
+
+    '''
+    Tokenizes a review on whitespace and converts each word with stem(lemmatize(word)),
+    with nltk's WordNetLemmatizer and PorterStemmer
+    '''
+
+    if _stemmer is None:
+        _init_worker()
+
+    words = []
+    for w in review.split():
+        stem = _stem_cache.get(w)
+        if stem is None:
+            stem = _stemmer.stem(_lemmatizer.lemmatize(w))
+            if len(_stem_cache) >= STEM_CACHE_SIZE:
+                # drop the oldest entry (dicts keep insertion order)
+                _stem_cache.pop(next(iter(_stem_cache)), None)
+            _stem_cache[w] = stem
+        words.append(stem)
+
+    return ' '.join(words)
+
+
+def shard_path(out_dir, shard):
+    return os.path.join(out_dir, f'shard_{shard:05d}.txt')
+
+
+def _process_shard(path, reviews):
+
+    # write to a temporary file first so a killed run never leaves a half written shard behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding = 'utf-8') as fp:
+        for review in reviews:
+            fp.write(preprocess_review(review) + '\n')
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def preprocess_reviews(reviews, out_dir, shard_size = 1000, processes = None):
+
+    '''
+    INPUT: an iterable of review texts (one document per restaurant), an output folder
+
+    OUTPUT: the list of shard files, in order; each holds one preprocessed review per line
+
+    Reviews are cut into shards of shard_size and preprocessed across a process pool.
+    Only a few shards per worker are held in memory at a time and each finished
+    shard is written straight to disk, so a rerun skips the shards already on disk.
+    Rerunning requires the same reviews in the same order and the same shard_size
+    '''
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+    os.makedirs(out_dir, exist_ok = True)
+    check_shard_size(out_dir, shard_size)
+
+    processes = processes or os.cpu_count()
+    max_pending = 2 * processes
+
+    reviews = iter(reviews)
+    shard_paths = []
+
+    with ProcessPoolExecutor(processes, initializer = _init_worker) as pool:
+        pending = set()
+
+        for shard in count():
+            chunk = list(islice(reviews, shard_size))
+            if not chunk:
+                break
+
+            path = shard_path(out_dir, shard)
+            shard_paths.append(path)
+            if os.path.exists(path):
+                continue
+
+            pending.add(pool.submit(_process_shard, path, chunk))
+
+            # bound the number of shards waiting in memory
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+        for future in pending:
+            future.result()
+
+    return shard_paths
+
+
+def check_shard_size(out_dir, shard_size):
+
+    '''
+    Records the shard size of the output folder and refuses to resume with a different one,
+    since the shard boundaries would not line up
+    '''
+
+    meta_path = os.path.join(out_dir, 'shards.json')
+
+    if os.path.exists(meta_path):
+        with open(meta_path) as fp:
+            previous = json.load(fp)['shard_size']
+        if previous != shard_size:
+            raise ValueError(f'{out_dir} was written with shard_size = {previous}, not {shard_size}')
+    else:
+        with open(meta_path, 'w') as fp:
+            json.dump({'shard_size': shard_size}, fp)
+
+
+class PreprocessedReviews:
+
+    '''
+    The preprocessed reviews of the shard files, read one at a time, e.g. for
+    Tfidf_vectorizer.fit_transform. Every iteration reads the shards again from the start,
+    so the fit_transform cell can be rerun
+    '''
+
+    def __init__(self, shard_paths):
+        self.shard_paths = list(shard_paths)
+
+    def __iter__(self):
+
+        for path in self.shard_paths:
+            with open(path, encoding = 'utf-8') as fp:
+                for line in fp:
+                    yield line.rstrip('\n')
+
+
+def read_preprocessed_reviews(shard_paths):
+
+    '''
+    Returns the preprocessed reviews of the shards as a re-iterable PreprocessedReviews
+    '''
+
+    return PreprocessedReviews(shard_paths)
+
+
+
+def category_matrix(categories, category_list):
+
+    '''
+    INPUT: a Series of comma separated category strings (the categories column),
+    a list of unique categories to encode
+
+    OUTPUT: a sparse CSR matrix of restaurants x category_list with a 1 where the restaurant
+    has the category, built in one pass over the split categories
+    '''
+
+    import numpy as np
+    import pandas as pd
+    from scipy import sparse
+
+    split = categories.fillna('').str.split(', ')
+
+    # one (restaurant, category) pair per listed category
+    rows = np.repeat(np.arange(len(split)), split.str.len().values)
+    columns = pd.Series(split.explode().values).map({cat: col for col, cat in enumerate(category_list)}).values
+
+    listed = ~pd.isna(columns)
+    matrix = sparse.csr_matrix((np.ones(listed.sum(), dtype = np.int8),
+                                (rows[listed], columns[listed].astype(np.int64))),
+                               shape = (len(split), len(category_list)))
+
+    # a category listed twice for one restaurant is still a 1
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+
+    return matrix
+
+
+def encode_categories(yelp_res, category_list, food_cat = None, city_list = None):
+
+    '''
+    One-hot encodes the categories, yelp_all_top20 and major_city of Data_Preprocessing.ipynb in one pass (no row loops)
+
+    OUTPUT: a copy of yelp_res (index reset) with a 0/1 column per category in category_list,
+    yelp_all_top20 (has one of the food_cat categories) when food_cat is given and
+    major_city (city is in city_list) when city_list is given
+    '''
+
+    import pandas as pd
+
+    yelp_all = yelp_res.reset_index(drop = True)
+
+    # category_list repeats a few names; the notebook ends up with one column for each
+    unique_categories = list(dict.fromkeys(category_list))
+    matrix = category_matrix(yelp_all['categories'], unique_categories)
+
+    flags = pd.DataFrame(matrix.toarray(), columns = unique_categories, index = yelp_all.index)
+    if food_cat is not None:
+        flags['yelp_all_top20'] = (category_matrix(yelp_all['categories'], food_cat).getnnz(axis = 1) > 0).astype(int)
+    if city_list is not None:
+        flags['major_city'] = yelp_all['city'].isin(city_list).astype(int)
+
+    return pd.concat([yelp_all.drop(columns = [col for col in flags.columns if col in yelp_all.columns]),
+                      flags], axis = 1)
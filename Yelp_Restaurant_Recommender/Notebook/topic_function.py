@@ -0,0 +1,443 @@
+import os
+import pickle
+import hashlib
+
+import pandas as pd
+from sklearn.feature_extraction import text
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.decomposition import TruncatedSVD
+
+
+my_stop_words = ['food', 'good', 'place']
+# sorted list: newer scikit-learn rejects sets, and the store keys on it
+stop_words = sorted(text.ENGLISH_STOP_WORDS.union(my_stop_words))
+
+# CountVectorizer settings used by city_cruisine_pipeline.ipynb
+VECTORIZER_PARAMS = {'ngram_range': (2,3)}
+
+
+def food_city_df_count_vectorizer(yelp_df, food_type, city, **vectorizer_params):
+
+    # create df
+    food_city_df = yelp_df[(yelp_df['city'] == city) & (yelp_df[food_type] == 1)]
+
+    # create a list of all the reviews for each restaurant
+    food_city_reviews = [review for review in food_city_df.text]
+
+    # tokenize the whole corpus into bigrams and trigrams only with binary = False
+    vectorizer = CountVectorizer(stop_words=stop_words, **dict(VECTORIZER_PARAMS, **vectorizer_params))
+    doc_word = vectorizer.fit_transform(food_city_reviews)
+    print(f'There are {doc_word.shape[0]} restaurants and {doc_word.shape[1]} vocabulary')
+
+    return doc_word, vectorizer
+
+
+class FeatureLookup(dict):
+
+    '''
+    column -> n-gram lookup of a hashed vocabulary; columns never seen in the sample read as hash_<column>
+    '''
+
+    def __missing__(self, column):
+        return f'hash_{column}'
+
+
+class HashedNgrams:
+
+    '''
+    A HashingVectorizer plus a reverse lookup of the n-grams seen in a sample of the corpus,
+    so display_topics / create_topic_dict can still print readable n-grams
+    '''
+
+    def __init__(self, vectorizer, lookup):
+        self.vectorizer = vectorizer
+        self.lookup = lookup
+
+    def transform(self, raw_documents):
+        return self.vectorizer.transform(raw_documents)
+
+    def get_feature_names_out(self):
+        return self.lookup
+
+
+def food_city_df_hashing_vectorizer(yelp_df, food_type, city, n_features = 2**18, sample_size = 50, **vectorizer_params):
+
+    '''
+    Same as food_city_df_count_vectorizer but hashes the n-grams into n_features columns,
+    so no vocabulary is built and memory does not grow with the number of distinct n-grams.
+    The n-grams of sample_size reviews are hashed again to fill the reverse lookup;
+    when several n-grams share a column the most frequent one is kept
+    '''
+
+    from collections import Counter
+
+    food_city_df = yelp_df[(yelp_df['city'] == city) & (yelp_df[food_type] == 1)]
+    food_city_reviews = [review for review in food_city_df.text]
+
+    vectorizer = HashingVectorizer(stop_words=stop_words, n_features=n_features,
+                                   alternate_sign=False, norm=None,
+                                   **dict(VECTORIZER_PARAMS, **vectorizer_params))
+    doc_word = vectorizer.transform(food_city_reviews)
+    print(f'There are {doc_word.shape[0]} restaurants hashed into {doc_word.shape[1]} columns')
+
+    # hash every sampled n-gram on its own to find its column
+    analyzer = vectorizer.build_analyzer()
+    ngram_counts = Counter(ngram for review in food_city_reviews[:sample_size] for ngram in analyzer(review))
+    ngrams = [ngram for ngram, count in ngram_counts.most_common()]
+
+    single_ngram = HashingVectorizer(analyzer=lambda ngram: [ngram], n_features=n_features,
+                                     alternate_sign=False, norm=None)
+    columns = single_ngram.transform(ngrams).indices if ngrams else []
+
+    lookup = FeatureLookup()
+    for column, ngram in zip(columns, ngrams):
+        lookup.setdefault(int(column), ngram)
+
+    return doc_word, HashedNgrams(vectorizer, lookup)
+
+
+def compare_vectorizers(yelp_df, food_type, city, num_topics = 4, n_features = 2**18):
+
+    '''
+    Fits the LSA topics of a city and food category with the count and the hashing vectorizer
+
+    OUTPUT: a DataFrame with the fit time (seconds), the peak memory traced by tracemalloc (MB)
+    and the number of columns of each
+    '''
+
+    import time
+    import tracemalloc
+
+    report = {}
+    for mode in ['count', 'hashing']:
+        tracemalloc.start()
+        start_time = time.time()
+
+        if mode == 'count':
+            doc_word, vectorizer = food_city_df_count_vectorizer(yelp_df, food_type, city)
+        else:
+            doc_word, vectorizer = food_city_df_hashing_vectorizer(yelp_df, food_type, city, n_features)
+        LSA(doc_word, num_topics)
+
+        fit_time = time.time() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        report[mode] = {'fit_seconds': fit_time, 'peak_mb': peak / 1e6, 'columns': doc_word.shape[1]}
+
+    return pd.DataFrame(report).T
+
+
+# Acronynms: Latent Semantic Analysis (LSA) is just another name for
+#  Signular Value Decomposition (SVD) applied to Natural Language Processing (NLP)
+def LSA(doc_word, num_topics):
+    lsa = TruncatedSVD(num_topics)
+    doc_topic = lsa.fit_transform(doc_word)
+    print(lsa.explained_variance_ratio_)
+    print(f'Total variance explained by these topics is: {sum(lsa.explained_variance_ratio_)}')
+
+    return lsa
+
+
+def display_topics(model, feature_names, no_top_words, topic_names=None):
+    '''
+    INPUT: model, word-feature-name, # of top_words
+
+    OUTPUT: List of word-features associated with each component
+    with highest correlations in descending order
+    '''
+    for ix, topic in enumerate(model.components_):
+        if not topic_names or not topic_names[ix]:
+            print("\nTopic ", ix)
+        else:
+            print("\nTopic: '",topic_names[ix],"'")
+        print(", ".join([feature_names[i]
+                        for i in topic.argsort()[:-no_top_words - 1:-1]]))
+
+
+def create_topic_dict(model, feature_names, no_top_words, topic_names=None):
+    '''
+    INPUT: model, feature_names, # of top_words
+
+    OUTPUT: a dictionary where keys are topics and values are the list of
+    words corresponding to that topic with the highest correlations
+    '''
+
+    # Create an empty dictionary by initializing all the topics
+    topic_dict = {k:[] for k in range(len(model.components_))}
+
+    # For each topic, append the word to the topic dictionary beginning with the highest correlation
+    for ix, topic in enumerate(model.components_):
+        for i in topic.argsort()[:-no_top_words - 1: -1]:
+            topic_dict[ix].append(feature_names[i])
+
+    return topic_dict
+
+
+def create_word_cloud(word_list, width=480, height=480, max_words=10):
+
+    '''
+    INPUT: a list of words
+    OUT: word cloud
+    '''
+
+    from wordcloud import WordCloud
+
+    # empty string is declare
+    text = ""
+
+    # iterating through list of words
+    for word in word_list :
+
+        text = text + " " + word
+
+    wordcloud = WordCloud(width=width, height=height, max_words=max_words).generate(text)
+    return wordcloud
+
+
+def get_feature_names(vectorizer):
+
+    # get_feature_names was renamed get_feature_names_out in scikit-learn 1.0
+    if hasattr(vectorizer, 'get_feature_names_out'):
+        return vectorizer.get_feature_names_out()
+    return vectorizer.get_feature_names()
+
+
+class TopicModelStore:
+
+    '''
+    Disk cache of fitted (vectorizer, LSA model) pairs keyed by
+    (city, cuisine, num_topics, vectorizer params)
+
+    data_path - the review table the models are fitted on (yelp_df_top_cities.pkl);
+    it is only unpickled when a model has to be fitted.
+    Every stored model remembers the modification time and size of data_path
+    and is refitted once the file changes
+    '''
+
+    def __init__(self, data_path = 'yelp_df_top_cities.pkl', store_dir = 'topic_models'):
+
+        self.data_path = data_path
+        self.store_dir = store_dir
+        self._yelp_df = None
+
+        os.makedirs(store_dir, exist_ok = True)
+
+    def data_signature(self):
+        stat = os.stat(self.data_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def yelp_df(self):
+
+        if self._yelp_df is None or self._yelp_df[1] != self.data_signature():
+            signature = self.data_signature()
+            self._yelp_df = (pd.read_pickle(self.data_path), signature)
+
+        return self._yelp_df[0]
+
+    def key(self, city, cuisine, num_topics, mode = 'count', **vectorizer_params):
+
+        params = dict(VECTORIZER_PARAMS, **vectorizer_params)
+
+        return (city, cuisine, num_topics, mode, tuple(sorted(params.items())), tuple(stop_words))
+
+    def path(self, key):
+
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]
+
+        return os.path.join(self.store_dir, f'{digest}.pkl')
+
+    def load(self, key):
+
+        '''
+        Returns the stored (vectorizer, lsa) of the key, or None when missing or stale
+        '''
+
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as fp:
+            stored = pickle.load(fp)
+
+        if stored['key'] != key or stored['data_signature'] != self.data_signature():
+            return None
+
+        return stored['vectorizer'], stored['lsa']
+
+    def save(self, key, vectorizer, lsa):
+
+        stored = {'key': key,
+                  'data_signature': self.data_signature(),
+                  'vectorizer': vectorizer,
+                  'lsa': lsa}
+
+        # write to a temporary file first so readers never see a half written model
+        path = self.path(key)
+        with open(path + '.tmp', 'wb') as fp:
+            pickle.dump(stored, fp)
+        os.replace(path + '.tmp', path)
+
+    def get(self, city, cuisine, num_topics, mode = 'count', **vectorizer_params):
+
+        '''
+        Returns the (vectorizer, lsa) of the city and cuisine, fitting and storing them on a miss.
+        mode = 'hashing' uses food_city_df_hashing_vectorizer instead of the CountVectorizer
+        '''
+
+        key = self.key(city, cuisine, num_topics, mode, **vectorizer_params)
+
+        models = self.load(key)
+        if models is None:
+            if mode == 'hashing':
+                doc_word, vectorizer = food_city_df_hashing_vectorizer(self.yelp_df(), cuisine, city, **vectorizer_params)
+            else:
+                doc_word, vectorizer = food_city_df_count_vectorizer(self.yelp_df(), cuisine, city, **vectorizer_params)
+            lsa = LSA(doc_word, num_topics)
+            self.save(key, vectorizer, lsa)
+            models = (vectorizer, lsa)
+
+        return models
+
+    def clear(self):
+
+        for file_name in os.listdir(self.store_dir):
+            if file_name.endswith('.pkl'):
+                os.remove(os.path.join(self.store_dir, file_name))
+
+
+def draw_topic_word_clouds(topic_dict, max_words_wc = 20, wc_width = 600, wc_height = 600):
+
+    '''
+    INPUT: a topic dictionary from create_topic_dict
+
+    OUTPUT: a figure with one word cloud per topic
+    '''
+
+    import collections
+    import matplotlib.pyplot as plt
+
+    # create word list from topic dictionary then make a word cloud for each topic
+    plt.figure(figsize = (10,10))
+    subplot = 1
+
+    # k is the topic num, v is the vocabulary most similar to that topic space
+    for k,v in topic_dict.items():
+        word_list = v
+
+        # count the frequency of the word list
+        counted_words = collections.Counter(word_list)
+
+        wordcloud = create_word_cloud(word_list, width = wc_width, height = wc_height, max_words=max_words_wc)
+        plt.subplot(2,3,subplot)
+        plt.imshow(wordcloud, interpolation="bilinear")
+        plt.axis("off")
+        plt.margins(x=0, y=0)
+
+        # create the title using the top two most frequency word for that topic
+        plt.title(counted_words.most_common(2)[0][0].upper())
+        subplot += 1
+
+    plt.tight_layout()
+
+
+def top_modeling(city, food_category,
+                 num_topics = 4, num_vocabs = 200,
+                 max_words_wc = 20, wc_width = 600, wc_height = 600, store = None, mode = 'count'):
+
+    '''
+    Draws a word cloud for each LSA topic of a city and food category.
+    The vectorizer and LSA model come from the store (./topic_models by default),
+    so only the first call for a (city, food_category, num_topics) fits them.
+    mode = 'hashing' vectorizes with feature hashing for large cities
+    '''
+
+    if store is None:
+        store = TopicModelStore()
+
+    vectorizer, model_lsa = store.get(city, food_category, num_topics, mode)
+
+    feature_names = get_feature_names(vectorizer)
+
+    # create a topic dictionary where the keys are the topics and values are the list of words
+    topic_dict = create_topic_dict(model_lsa, feature_names, num_vocabs)
+
+    draw_topic_word_clouds(topic_dict, max_words_wc, wc_width, wc_height)
+
+
+# TopicModelStore of each worker process of precompute_topics
+_worker_store = None
+
+
+def _init_topic_worker(store):
+
+    global _worker_store
+    _worker_store = store
+
+
+def _fit_topic_summary(city, cuisine, num_topics, num_vocabs, mode):
+
+    try:
+        vectorizer, lsa = _worker_store.get(city, cuisine, num_topics, mode)
+    except ValueError as error:
+        # no restaurants (or only stop words) for this city and cuisine
+        print(f'Skipping {city} / {cuisine}: {error}')
+        return None
+
+    return {'city': city,
+            'cuisine': cuisine,
+            'num_topics': num_topics,
+            'topic_dict': create_topic_dict(lsa, get_feature_names(vectorizer), num_vocabs),
+            'explained_variance_ratio': lsa.explained_variance_ratio_,
+            'total_variance': sum(lsa.explained_variance_ratio_)}
+
+
+def precompute_topics(city_list, food_cat, store = None, num_topics = 4, num_vocabs = 200,
+                      mode = 'count', processes = None, summary_path = None):
+
+    '''
+    Fits the LSA topics of every (city in city_list, cuisine in food_cat) across a process pool
+    and pickles the topic dictionaries and explained variances to summary_path
+    (topic_summaries.pkl in the store folder by default)
+
+    RETURN: a DataFrame with the explained variance of each city and cuisine
+    '''
+
+    from itertools import product
+    from concurrent.futures import ProcessPoolExecutor
+
+    if store is None:
+        store = TopicModelStore()
+    if summary_path is None:
+        summary_path = os.path.join(store.store_dir, 'topic_summaries.pkl')
+
+    # unpickle the reviews once here: forked workers inherit them, spawned workers receive them
+    # once through initargs, instead of every task reading the pickle again
+    store.yelp_df()
+
+    pairs = list(product(city_list, food_cat))
+    with ProcessPoolExecutor(processes, initializer = _init_topic_worker, initargs = (store,)) as pool:
+        futures = [pool.submit(_fit_topic_summary, city, cuisine, num_topics, num_vocabs, mode)
+                   for city, cuisine in pairs]
+        summaries = [future.result() for future in futures]
+
+    summaries = {(summary['city'], summary['cuisine']): summary for summary in summaries if summary is not None}
+    pd.to_pickle(summaries, summary_path)
+
+    return pd.DataFrame([{'city': city, 'cuisine': cuisine,
+                          'num_topics': summary['num_topics'], 'total_variance': summary['total_variance']}
+                         for (city, cuisine), summary in summaries.items()])
+
+
+def top_modeling_precomputed(city, food_category, summaries,
+                             max_words_wc = 20, wc_width = 600, wc_height = 600):
+
+    '''
+    Draws the word clouds of a city and food category from the summaries of precompute_topics
+    (the dict or the path of its pickle) without touching the reviews
+    '''
+
+    if isinstance(summaries, str):
+        summaries = pd.read_pickle(summaries)
+
+    draw_topic_word_clouds(summaries[(city, food_category)]['topic_dict'], max_words_wc, wc_width, wc_height)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from help_function import (build_topic_index, names_digest, normalize_rows, top_k_indices, topic_store_to_doc_topic,
+                           write_pickle)
+
+
+def spherical_kmeans(topic, num_clusters, iterations = 10, seed = 0):
+
+    '''
+    INPUT: unit-length topic vectors (rows), # of clusters
+
+    OUTPUT: (centroids, assignment) where centroids are unit length and
+    assignment holds the cluster of each row (the centroid with the highest cosine similarity)
+    '''
+
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, min(num_clusters, len(topic)))
+
+    centroids = topic[rng.choice(len(topic), num_clusters, replace = False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assignment = np.argmax(topic @ centroids.T, axis = 1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, topic)
+
+        # re-seed empty clusters with random rows so no centroid goes to waste
+        empty = np.flatnonzero(np.bincount(assignment, minlength = num_clusters) == 0)
+        sums[empty] = topic[rng.choice(len(topic), len(empty))]
+
+        centroids = normalize_rows(sums).astype(np.float32)
+
+    assignment = np.argmax(topic @ centroids.T, axis = 1)
+
+    return centroids, assignment
+
+
+def build_ivf(topic_block, num_clusters = None, iterations = 10, seed = 0, names = None):
+
+    '''
+    Builds an inverted-file (IVF) index over the topic rows of one city
+
+    OUTPUT: a dict with
+    centroids - one unit-length vector per cluster
+    rows - the row positions of the block grouped cluster by cluster
+    offsets - rows[offsets[c]:offsets[c + 1]] are the rows of cluster c
+    size - # of rows the index was built over
+    names - names_digest of the restaurant names of those rows (None when names is not given)
+    '''
+
+    if num_clusters is None:
+        num_clusters = int(np.sqrt(len(topic_block)))
+
+    centroids, assignment = spherical_kmeans(topic_block, num_clusters, iterations, seed)
+
+    rows = np.argsort(assignment, kind = 'stable').astype(np.int32)
+    offsets = np.r_[0, np.cumsum(np.bincount(assignment, minlength = len(centroids)))].astype(np.int32)
+
+    return {'centroids': centroids,
+            'rows': rows,
+            'offsets': offsets,
+            'size': len(topic_block),
+            'names': None if names is None else names_digest(names)}
+
+
+def build_ann_index(doc_topic, num_clusters = None, iterations = 10, seed = 0):
+
+    '''
+    INPUT: a doc-topic DataFrame (as in doc_topic_lsa.pkl / doc_topic_nmf.pkl)
+
+    OUTPUT: a dict of city -> IVF index over that city's block of the topic index
+    '''
+
+    index = build_topic_index(doc_topic)
+
+    return {city: build_ivf(index['topic'][offset:offset + length], num_clusters, iterations, seed,
+                            index['name'][offset:offset + length])
+            for city, (offset, length) in index['cities'].items()}
+
+
+def save_ann_index(model = 'lsa', artifact_dir = '.', **kwargs):
+
+    '''
+    Builds the IVF index of the doc-topic table of the model and pickles it as ivf_<model>.pkl.
+    Like the engine, it reads the topic store doc_topic_<model>/ when one exists and
+    doc_topic_<model>.pkl otherwise
+    '''
+
+    import os
+
+    store_dir = os.path.join(artifact_dir, f'doc_topic_{model}')
+    if os.path.exists(os.path.join(store_dir, 'index.pkl')):
+        doc_topic = topic_store_to_doc_topic(store_dir)
+    else:
+        doc_topic = pd.read_pickle(os.path.join(artifact_dir, f'doc_topic_{model}.pkl'))
+
+    ann_index = build_ann_index(doc_topic, **kwargs)
+    write_pickle(ann_index, os.path.join(artifact_dir, f'ivf_{model}.pkl'))
+
+    return ann_index
+
+
+def search_ivf(ivf, topic_block, search_vector, nprobe):
+
+    '''
+    Scores only the rows of the nprobe clusters closest to the search vector.
+    A larger nprobe raises recall at the cost of latency (nprobe = # of clusters is an exact scan)
+
+    OUTPUT: (candidate rows of the block, their cosine similarity)
+    '''
+
+    if nprobe < 1:
+        raise ValueError(f'nprobe must be at least 1, not {nprobe}')
+
+    centroids, offsets = ivf['centroids'], ivf['offsets']
+
+    probes = top_k_indices(centroids @ search_vector, nprobe)
+    candidates = np.concatenate([ivf['rows'][offsets[c]:offsets[c + 1]] for c in probes])
+
+    return candidates, topic_block[candidates] @ search_vector
+
+
+def recall_report(doc_topic, ann_index, search_vectors, k = 10, nprobes = (1, 2, 4, 8, 16)):
+
+    '''
+    INPUT: a doc-topic DataFrame, its ann_index, a matrix of query topic vectors (one per row)
+
+    OUTPUT: a DataFrame with the mean recall@k against the exact scan, the mean share of
+    restaurants scored and the mean latency (ms) of the IVF search for each nprobe,
+    averaged over every query and city
+    '''
+
+    import time
+
+    index = build_topic_index(doc_topic)
+    search_vectors = normalize_rows(search_vectors).astype(np.float32)
+
+    report = []
+    for nprobe in nprobes:
+        recalls, scanned, latencies = [], [], []
+
+        for city, (offset, length) in index['cities'].items():
+            topic_block = index['topic'][offset:offset + length]
+            ivf = ann_index[city]
+
+            for search_vector in search_vectors:
+                exact = set(top_k_indices(topic_block @ search_vector, k))
+
+                start_time = time.perf_counter()
+                candidates, cosine_array = search_ivf(ivf, topic_block, search_vector, nprobe)
+                approximate = candidates[top_k_indices(cosine_array, k)]
+                latencies.append(time.perf_counter() - start_time)
+
+                recalls.append(len(exact.intersection(approximate)) / len(exact))
+                scanned.append(len(candidates) / length)
+
+        report.append({'nprobe': nprobe,
+                       f'recall@{k}': np.mean(recalls),
+                       'scanned': np.mean(scanned),
+                       'latency_ms': np.mean(latencies) * 1000})
+
+    return pd.DataFrame(report).set_index('nprobe')
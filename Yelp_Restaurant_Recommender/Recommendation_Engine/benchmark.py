@@ -0,0 +1,201 @@
+import json
+import time
+
+import numpy as np
+
+import help_function
+
+
+# fixed query corpus, run against every city
+QUERIES = ['Burgers and fries for dinner with good service',
+           'Burgers and fries for lunch',
+           'Morning Coffee and breakfast food',
+           'pizza and salad',
+           'Salad and pizza',
+           'sushi and ramen for a late dinner',
+           'spicy chicken wings and beer',
+           'vegan brunch with good coffee',
+           'cheap tacos and burritos',
+           'romantic steakhouse with a wine list',
+           'dim sum on a weekend morning',
+           'fresh seafood and oysters',
+           'family friendly italian pasta',
+           'quick sandwich near the office',
+           'authentic thai curry',
+           'bbq ribs and brisket',
+           'ice cream and dessert',
+           'healthy lunch salad bowl',
+           'late night pho',
+           'all you can eat buffet']
+
+
+def summarize(latencies):
+
+    '''
+    Returns count, mean and p50/p95/p99 of a list of latencies, in milliseconds
+    '''
+
+    latencies = np.asarray(latencies) * 1000
+
+    return {'count': len(latencies),
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99))}
+
+
+def benchmark_engine(artifact_dir = '.'):
+
+    # no result cache, so repeated queries measure the full pipeline
+    return help_function.RecommenderEngine(artifact_dir, cache_size = 0)
+
+
+def cold_start(model = 'lsa', artifact_dir = '.'):
+
+    '''
+    Time to the first result of a fresh engine (artifact loading included), then of the second query
+    '''
+
+    start_time = time.perf_counter()
+    engine = benchmark_engine(artifact_dir)
+    city = next(iter(engine.topic_index(model)['cities']))
+    engine.find_similarity(QUERIES[0], 5, city, model)
+    cold = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    engine.find_similarity(QUERIES[1], 5, city, model)
+    warm = time.perf_counter() - start_time
+
+    return {'cold_ms': cold * 1000, 'first_warm_ms': warm * 1000}
+
+
+def latency(engine, model = 'lsa', top_search = 5, repeats = 3):
+
+    '''
+    End-to-end latency of every query x city, repeated `repeats` times
+    '''
+
+    cities = list(engine.topic_index(model)['cities'])
+    latencies = []
+
+    for _ in range(repeats):
+        for city in cities:
+            for search in QUERIES:
+                start_time = time.perf_counter()
+                engine.find_similarity(search, top_search, city, model)
+                latencies.append(time.perf_counter() - start_time)
+
+    return summarize(latencies)
+
+
+def stage_breakdown(engine, model = 'lsa', top_search = 5):
+
+    '''
+    Latency of each stage of a query:
+    preprocess, vectorize (Tfidf transform), project (topic model transform),
+    embed (the engine's vectorize + project, which may take the QueryProjector fast path),
+    score (cosine against the city) and sort (top-k and result DataFrame)
+    '''
+
+    stages = {stage: [] for stage in ['preprocess', 'vectorize', 'project', 'embed', 'score', 'sort']}
+    vectorizer, topic_model = engine.get('tfidf'), engine.get(model)
+
+    def timed(stage, function, *args):
+        start_time = time.perf_counter()
+        result = function(*args)
+        stages[stage].append(time.perf_counter() - start_time)
+        return result
+
+    for city in engine.topic_index(model)['cities']:
+        restaurant_topic_array, restaurant_index = engine.city_block(city, model)
+
+        for search in QUERIES:
+            preprocessed_search = timed('preprocess', help_function.preprocessing, search)
+            vectorized_text = timed('vectorize', vectorizer.transform, preprocessed_search)
+            timed('project', topic_model.transform, vectorized_text)
+            search_vector = timed('embed', engine.transform, preprocessed_search, model)
+
+            search_vector = help_function.normalize_rows(search_vector).reshape(-1).astype(restaurant_topic_array.dtype)
+            cosine_array = timed('score', np.dot, restaurant_topic_array, search_vector)
+            timed('sort', help_function.rank_restaurants, cosine_array, restaurant_index, top_search + 20)
+
+    return {stage: summarize(latencies) for stage, latencies in stages.items()}
+
+
+def throughput(model = 'lsa', concurrency = (1, 2, 4, 8), artifact_dir = '.', processes = False, repeats = 2):
+
+    '''
+    Queries per second with `concurrency` queries in flight, on threads sharing one engine
+    or (processes = True) on a serving.RecommenderPool with one worker per level
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    engine = help_function.get_engine(artifact_dir)
+    cities = list(engine.topic_index(model)['cities'])
+    # a suffix per repeat keeps every query distinct, so no result cache can answer it
+    queries = [(f'{search} {n}', city) for n in range(repeats) for city in cities for search in QUERIES]
+
+    results = {}
+    for level in concurrency:
+        if processes:
+            from serving import RecommenderPool
+
+            with RecommenderPool(level, artifact_dir, (model,)) as pool:
+                pool.find_similarity(QUERIES[0], 5, cities[0], model)
+
+                start_time = time.perf_counter()
+                futures = [pool.submit(f'{search} {level}', 5, city, model) for search, city in queries]
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - start_time
+        else:
+            engine = benchmark_engine(artifact_dir).warm_up((model,))
+
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(level) as pool:
+                list(pool.map(lambda query: engine.find_similarity(query[0], 5, query[1], model), queries))
+            elapsed = time.perf_counter() - start_time
+
+        results[str(level)] = {'queries': len(queries), 'queries_per_sec': len(queries) / elapsed}
+
+    return results
+
+
+def run_benchmark(models = ('lsa', 'nmf'), artifact_dir = '.', concurrency = (1, 2, 4, 8), processes = False):
+
+    '''
+    Runs the whole suite for each model
+
+    RETURN: a JSON-serializable dict of the results
+    '''
+
+    report = {}
+    for model in models:
+        report[model] = {'cold_start': cold_start(model, artifact_dir)}
+
+        engine = benchmark_engine(artifact_dir).warm_up((model,))
+        report[model]['latency'] = latency(engine, model)
+        report[model]['stages'] = stage_breakdown(engine, model)
+        report[model]['throughput'] = throughput(model, concurrency, artifact_dir, processes)
+
+    return report
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'Latency and throughput benchmark of the Yelp recommender')
+    parser.add_argument('--models', nargs = '+', default = ['lsa', 'nmf'])
+    parser.add_argument('--artifact-dir', default = '.')
+    parser.add_argument('--concurrency', nargs = '+', type = int, default = [1, 2, 4, 8])
+    parser.add_argument('--processes', action = 'store_true', help = 'use a RecommenderPool instead of threads')
+    parser.add_argument('--output', default = 'benchmark.json')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.models, args.artifact_dir, args.concurrency, args.processes)
+
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent = 2)
+    print(json.dumps(report, indent = 2))
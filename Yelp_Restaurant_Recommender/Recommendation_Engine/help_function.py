@@ -1,100 +1,1068 @@
-def preprocessing(texts):
-    
-    from nltk.stem import WordNetLemmatizer
-    
-    lemmatizer = WordNetLemmatizer()
+import os
+import threading
+import time
 
-    return [''.join([(lemmatizer.lemmatize(w)) for w in texts])]
 
+# file names of the pickled artifacts written by model_training.ipynb
+ARTIFACTS = {'tfidf': 'Tfidf.pkl',
+             'lsa': 'lsa_model.pkl',
+             'nmf': 'nmf_model.pkl',
+             'doc_topic_lsa': 'doc_topic_lsa.pkl',
+             'doc_topic_nmf': 'doc_topic_nmf.pkl',
+             # optional memory-mapped topic stores written by save_topic_store
+             'topic_store_lsa': os.path.join('doc_topic_lsa', 'index.pkl'),
+             'topic_store_nmf': os.path.join('doc_topic_nmf', 'index.pkl'),
+             # optional IVF indexes written by ann_index.save_ann_index
+             'ivf_lsa': 'ivf_lsa.pkl',
+             'ivf_nmf': 'ivf_nmf.pkl',
+             # optional re-ranking features written by save_restaurant_features
+             'features': 'restaurant_features.pkl'}
+
+
+class RecommenderEngine:
+
+    '''
+    Long-lived recommender that unpickles the vectorizer, the topic models and
+    the doc-topic tables once and keeps them resident between queries
+
+    artifact_dir - the folder holding the pickles (defaults to the working directory)
+    check_interval - seconds between checks of the pickles on disk; a pickle whose
+    modification time or size has changed is reloaded on the next query
+    cache_size, cache_ttl - bounds of the query result cache (see QueryCache)
+    '''
+
+    def __init__(self, artifact_dir = '.', check_interval = 2.0, cache_size = 1024, cache_ttl = 600):
+
+        self.artifact_dir = artifact_dir
+        self.check_interval = check_interval
+
+        # name -> (loaded object, (mtime, size) of the file it was loaded from)
+        self._artifacts = {}
+        # model -> (doc-topic table the index was built from, scoring index)
+        self._indexes = {}
+        # model -> (vectorizer, topic model, QueryProjector built from them)
+        self._projectors = {}
+        # (model, city) -> (IVF indexes, scoring index, the city's IVF index or None when stale)
+        self._ann_indexes = {}
+        # model -> (features, scoring index, whether their rows line up)
+        self._feature_checks = {}
+        self._last_check = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.cache = QueryCache(cache_size, cache_ttl)
+
+    def artifact_path(self, name):
+        return os.path.join(self.artifact_dir, ARTIFACTS[name])
+
+    def _signature(self, name):
+        stat = os.stat(self.artifact_path(name))
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, name):
+
+        import pandas as pd
+
+        signature = self._signature(name)
+        with timed_stage('artifact_load'):
+            if name.startswith('topic_store_'):
+                artifact = load_topic_store(os.path.dirname(self.artifact_path(name)))
+            else:
+                artifact = pd.read_pickle(self.artifact_path(name))
+        self._artifacts[name] = (artifact, signature)
+        count_event('artifact_loads')
+
+        return artifact
+
+    def get(self, name):
+
+        '''
+        Returns the resident artifact, loading it on first use
+        '''
+
+        self.reload_if_changed()
+
+        entry = self._artifacts.get(name)
+        if entry is not None:
+            return entry[0]
+
+        with self._lock:
+            entry = self._artifacts.get(name)
+            if entry is not None:
+                return entry[0]
+            return self._load(name)
+
+    def reload_if_changed(self, force = False):
+
+        '''
+        Reloads every resident artifact whose pickle changed on disk.
+        The check is skipped unless check_interval seconds have passed (or force = True)
+
+        RETURN: a list of the reloaded artifact names
+        '''
+
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return []
+        self._last_check = now
+
+        reloaded = []
+        with self._lock:
+            for name, (artifact, signature) in list(self._artifacts.items()):
+                try:
+                    current = self._signature(name)
+                except FileNotFoundError:
+                    # keep serving the old copy while the file is being replaced
+                    continue
+                if current != signature:
+                    self._load(name)
+                    reloaded.append(name)
+
+        # cached results were ranked with the old artifacts
+        if reloaded:
+            self.cache.clear()
+
+        return reloaded
+
+    def warm_up(self, models = ('lsa', 'nmf')):
+
+        '''
+        Loads the vectorizer, WordNet, and the topic model, QueryProjector and doc-topic table
+        of each model up front (before a RecommenderPool forks, so the workers share them)
+        '''
+
+        load_stemmers()
+        self.get('tfidf')
+        for model in models:
+            self.get(model)
+            self.projector(model)
+            self.topic_index(model)
+
+        return self
+
+    def projector(self, model = 'lsa'):
+
+        '''
+        Returns the QueryProjector of the model (None when the model is not supported),
+        rebuilt whenever the vectorizer or the topic model is reloaded
+        '''
+
+        vectorizer, topic_model = self.get('tfidf'), self.get(model)
+
+        cached = self._projectors.get(model)
+        if cached is not None and cached[0] is vectorizer and cached[1] is topic_model:
+            return cached[2]
+
+        projector = QueryProjector(vectorizer, topic_model) if QueryProjector.supports(vectorizer, topic_model) else None
+        self._projectors[model] = (vectorizer, topic_model, projector)
+
+        return projector
+
+    def transform(self, preprocessed_texts, model = 'lsa'):
+
+        '''
+        Projects preprocessed texts into the topic space of the model.
+        A few short searches go through the QueryProjector, larger batches through
+        Tfidf_vectorizer.transform and the model's own transform
+        '''
+
+        import numpy as np
+
+        if len(preprocessed_texts) <= 16:
+            projector = self.projector(model)
+            if projector is not None:
+                return np.array([projector.project(text) for text in preprocessed_texts])
+
+        vectorized_text = self.get('tfidf').transform(preprocessed_texts)
+
+        return self.get(model).transform(vectorized_text)
+
+    def topic_index(self, model = 'lsa'):
+
+        '''
+        Returns the scoring index built from the doc-topic table of the model.
+        Rows are grouped by city into one contiguous float32 matrix of unit-length topic vectors:
+
+        topic - the row-normalized topic matrix, ordered by city
+        name - the restaurant names in the same order
+        cities - a dict of city -> (offset, length) of its block of rows
+
+        When a topic store (doc_topic_<model>/) exists it is memory-mapped as is,
+        otherwise the index is built from the doc-topic pickle and rebuilt whenever it is reloaded
+        '''
+
+        if os.path.exists(self.artifact_path('topic_store_' + model)):
+            return self.get('topic_store_' + model)
+
+        doc_topic = self.get('doc_topic_' + model)
+
+        cached = self._indexes.get(model)
+        if cached is not None and cached[0] is doc_topic:
+            return cached[1]
+
+        index = build_topic_index(doc_topic)
+        self._indexes[model] = (doc_topic, index)
+
+        return index
+
+    def city_block(self, location, model = 'lsa'):
+
+        '''
+        Returns (topic rows, restaurant names) of the city as views into the topic index
+        '''
+
+        index = self.topic_index(model)
+
+        try:
+            offset, length = index['cities'][location]
+        except KeyError:
+            raise ValueError(f'Unknown location {location!r}, available cities are: '
+                             + ', '.join(sorted(index['cities']))) from None
+
+        return index['topic'][offset:offset + length], index['name'][offset:offset + length]
+
+    def ann_index(self, location, model = 'lsa'):
+
+        '''
+        Returns the IVF index of the city, or None when ivf_<model>.pkl is missing
+        or was built from different restaurants (or the same ones in a different order)
+        than the city's block of the topic index
+        '''
+
+        if not os.path.exists(self.artifact_path('ivf_' + model)):
+            return None
+
+        ann_indexes, index = self.get('ivf_' + model), self.topic_index(model)
+
+        # the names are only compared again when either side is reloaded
+        cached = self._ann_indexes.get((model, location))
+        if cached is not None and cached[0] is ann_indexes and cached[1] is index:
+            return cached[2]
+
+        ivf = ann_indexes.get(location)
+        offset, length = index['cities'][location]
+        if ivf is not None and (ivf['size'] != length or ivf.get('names') is None
+                                or ivf['names'] != names_digest(index['name'][offset:offset + length])):
+            ivf = None
+
+        self._ann_indexes[(model, location)] = (ann_indexes, index, ivf)
+
+        return ivf
+
+    def city_features(self, location, model = 'lsa'):
+
+        '''
+        Returns the re-ranking feature rows of the city, aligned with city_block
+        '''
+
+        import numpy as np
+
+        features = self.get('features')
+        index = self.topic_index(model)
+
+        # the names are only compared again when either side is reloaded
+        cached = self._feature_checks.get(model)
+        if cached is None or cached[0] is not features or cached[1] is not index:
+            aligned = ('name' in features and len(features['name']) == len(index['name'])
+                       and np.array_equal(features['name'], index['name']))
+            cached = self._feature_checks[model] = (features, index, aligned)
+
+        if not cached[2]:
+            raise ValueError('restaurant_features.pkl does not list the restaurants of the topic index '
+                             'in the same order, rerun save_restaurant_features')
+
+        offset, length = index['cities'][location]
+
+        return features['values'][offset:offset + length]
+
+    def feature_weights(self, weights):
+
+        '''
+        Turns a dict of feature name -> weight into a weight vector over the feature columns
+        '''
+
+        import numpy as np
+
+        columns = self.get('features')['columns']
+        unknown = set(weights) - set(columns)
+        if unknown:
+            raise ValueError(f'Unknown features: {", ".join(sorted(unknown))}')
+
+        return np.array([weights.get(column, 0) for column in columns], dtype = np.float32)
+
+    def find_similarity(self, search, top_search, location, model = 'lsa', random = False, nprobe = None,
+                        weights = None, candidates = 200):
+
+        '''
+        Ranks the restaurants of the location by cosine similarity with the search.
+        With nprobe set and an IVF index on disk, only the nprobe closest clusters are scored.
+
+        With weights (a dict of feature name -> weight, see save_restaurant_features) the
+        `candidates` most similar restaurants are re-ranked by Similarity + features @ weights
+        and a Score column is added.
+
+        The ranked top_search + 20 restaurants are cached per normalized search, location,
+        model, top_search, nprobe and weights; random sampling happens after the cache lookup
+        '''
+
+        if nprobe is not None and nprobe < 1:
+            raise ValueError(f'nprobe must be at least 1, not {nprobe}')
+
+        # the normalized search is both the cache key and what gets ranked, so a cached result
+        # is always the one the search would have produced
+        search = normalize_query(search)
+        weight_key = tuple(sorted(weights.items())) if weights else None
+        key = (search, location, model, top_search, nprobe, weight_key, candidates)
+
+        count_event('queries')
+
+        ranked = self.cache.get(key)
+        if ranked is None:
+            count_event('cache_misses')
+            ranked = self._rank(search, top_search + 20, location, model, nprobe, weights, candidates)
+            self.cache.put(key, ranked)
+        else:
+            count_event('cache_hits')
+
+        with timed_stage('sample'):
+            return select_restaurants(ranked, top_search, random)
+
+    def _rank(self, search, num_results, location, model, nprobe, weights = None, candidates = 200):
+
+        with timed_stage('city_filter'):
+            restaurant_topic_array, restaurant_index = self.city_block(location, model)
+
+        with timed_stage('preprocess'):
+            preprocessed_search = preprocessing(search)
+
+        with timed_stage('transform'):
+            search_vector = normalize_rows(self.transform(preprocessed_search, model)).reshape(-1)
+            search_vector = search_vector.astype(restaurant_topic_array.dtype)
+
+        with timed_stage('score'):
+            ivf = self.ann_index(location, model) if nprobe is not None else None
+            if ivf is not None:
+                from ann_index import search_ivf
+
+                rows, cosine_array = search_ivf(ivf, restaurant_topic_array, search_vector, nprobe)
+            else:
+                # cosine similarity of every restaurant in the city with a single matrix-vector product
+                rows, cosine_array = None, restaurant_topic_array @ search_vector
+
+        if not weights:
+            with timed_stage('sort'):
+                return rank_restaurants(cosine_array, restaurant_index if rows is None else restaurant_index[rows],
+                                        num_results)
+
+        # second stage: re-rank the best candidates with the precomputed restaurant features
+        with timed_stage('rerank'):
+            top = top_k_indices(cosine_array, max(candidates, num_results))
+            top_rows = top if rows is None else rows[top]
+
+            return rerank_restaurants(cosine_array[top], self.city_features(location, model)[top_rows],
+                                      self.feature_weights(weights), restaurant_index[top_rows], num_results)
+
+    def find_similarity_batch(self, queries, model = 'lsa', random = False):
+
+        '''
+        INPUT: a list of (search, location, top_search) tuples
+
+        OUTPUT: a list with the ranked Similarity DataFrame of each query, in the same order
+
+        Queries missing from the cache are vectorized with one Tfidf and one topic model transform,
+        then the queries of each city are scored together with one matrix-matrix product.
+        Their results are cached, so the batch API also serves to warm the cache
+        '''
+
+        import numpy as np
+
+        if len(queries) == 0:
+            return []
+
+        searches, locations, top_searches = zip(*queries)
+
+        # look up every city first so an unknown location fails before any work is done
+        with timed_stage('city_filter'):
+            blocks = {location: self.city_block(location, model) for location in set(locations)}
+
+        # same keys as find_similarity without nprobe or weights
+        searches = [normalize_query(search) for search in searches]
+        keys = [(search, location, model, top_search, None, None, 200)
+                for search, location, top_search in zip(searches, locations, top_searches)]
+        ranked = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(ranked) if result is None]
+
+        count_event('queries', len(queries))
+        count_event('cache_hits', len(queries) - len(missing))
+        count_event('cache_misses', len(missing))
+
+        if missing:
+            with timed_stage('preprocess'):
+                preprocessed_searches = [preprocessing(searches[i])[0] for i in missing]
+            with timed_stage('transform'):
+                search_vectors = normalize_rows(self.transform(preprocessed_searches, model))
+
+            for location, (restaurant_topic_array, restaurant_index) in blocks.items():
+                columns = [j for j, i in enumerate(missing) if locations[i] == location]
+                if not columns:
+                    continue
+
+                # (restaurants in the city) x (queries for the city)
+                with timed_stage('score'):
+                    cosine_matrix = restaurant_topic_array @ search_vectors[columns].astype(restaurant_topic_array.dtype).T
+
+                with timed_stage('sort'):
+                    for column, j in enumerate(columns):
+                        i = missing[j]
+                        ranked[i] = rank_restaurants(np.ascontiguousarray(cosine_matrix[:, column]),
+                                                     restaurant_index, top_searches[i] + 20)
+                        self.cache.put(keys[i], ranked[i])
+
+        with timed_stage('sample'):
+            return [select_restaurants(ranked[i], top_searches[i], random) for i in range(len(queries))]
+
+
+class QueryProjector:
+
+    '''
+    Projects a single search into topic space touching only the vocabulary columns of its terms.
+
+    The IDF weights are folded into the topic components once, so a search costs
+    O(# of terms x # of topics) instead of a sparse product against the whole vocabulary.
+    For LSA the projection is the transform itself. For NMF the non-negative least squares
+    problem of the transform is solved against the cached Gram matrix of the components:
+    the unconstrained solution is used when it is already non-negative, otherwise an exact
+    active-set solve (scipy nnls) on its cached Cholesky factor; sklearn's iterative solver
+    reaches the same optimum only up to its tolerance
+    '''
+
+    def __init__(self, vectorizer, model):
+
+        import numpy as np
+
+        self.analyzer = vectorizer.build_analyzer()
+
+        # the vocabulary as a sorted array of utf-8 terms and their columns instead of a dict:
+        # two flat buffers that forked serving workers share, where the dict's keys and values
+        # are objects whose refcounts every lookup writes (copying their pages into each worker)
+        terms = np.array([term.encode('utf-8') for term in vectorizer.vocabulary_], dtype = bytes)
+        order = np.argsort(terms)
+        self.terms = terms[order]
+        self.term_columns = np.fromiter(vectorizer.vocabulary_.values(), dtype = np.int64,
+                                        count = len(terms))[order]
+        self.binary = vectorizer.binary
+        self.sublinear_tf = vectorizer.sublinear_tf
+        self.norm = vectorizer.norm
+
+        components = model.components_
+        idf = vectorizer.idf_ if vectorizer.use_idf else np.ones(components.shape[1])
+
+        # (vocabulary x topics) components with the idf folded in
+        self.weighted_components = np.ascontiguousarray((components * idf).T)
+        self.idf = idf
+
+        self.nmf = is_nmf(model)
+        if self.nmf:
+            gram = components @ components.T
+            cholesky = np.linalg.cholesky(gram)
+            self.gram_inverse = np.linalg.inv(gram)
+            self.cholesky_t = cholesky.T
+            self.cholesky_inverse = np.linalg.inv(cholesky)
+
+    @staticmethod
+    def supports(vectorizer, model):
+
+        '''
+        Only TF-IDF vectorizers with LSA, or with unregularized Frobenius NMF, are projected
+        '''
+
+        if not hasattr(vectorizer, 'idf_') and getattr(vectorizer, 'use_idf', False):
+            return False
+        if not all(hasattr(vectorizer, attr) for attr in ('vocabulary_', 'sublinear_tf', 'norm', 'binary')):
+            return False
+        if is_nmf(model):
+            return (getattr(model, 'beta_loss', 'frobenius') in ('frobenius', 2)
+                    and not getattr(model, 'alpha_W', 0) and not getattr(model, 'alpha', 0))
+        return hasattr(model, 'components_')
+
+    def project(self, text):
+
+        import numpy as np
+
+        tokens = np.array([token.encode('utf-8') for token in self.analyzer(text)], dtype = bytes)
+        if len(tokens) and len(self.terms):
+            positions = np.minimum(np.searchsorted(self.terms, tokens), len(self.terms) - 1)
+            positions = positions[self.terms[positions] == tokens]
+        else:
+            positions = np.array([], dtype = np.intp)
+        if len(positions) == 0:
+            return np.zeros(self.weighted_components.shape[1])
+
+        columns, tf = np.unique(self.term_columns[positions], return_counts = True)
+        tf = tf.astype(np.float64)
+
+        if self.binary:
+            tf[:] = 1
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1
+
+        weights = tf * self.idf[columns]
+        if self.norm == 'l2':
+            tf = tf / np.sqrt(weights @ weights)
+        elif self.norm == 'l1':
+            tf = tf / np.abs(weights).sum()
+
+        # the tf-idf row times the transposed components
+        projection = tf @ self.weighted_components[columns]
+        if not self.nmf:
+            return projection
+
+        topic_vector = self.gram_inverse @ projection
+        if (topic_vector >= 0).all():
+            return topic_vector
+
+        from scipy.optimize import nnls
+
+        return nnls(self.cholesky_t, self.cholesky_inverse @ projection)[0]
+
+
+def is_nmf(model):
+    return type(model).__name__ == 'NMF'
+
+
+class QueryCache:
+
+    '''
+    Bounded LRU cache of ranked results with an optional time-to-live (seconds)
+
+    Keeps hits, misses, evictions (entries dropped for room) and expirations (entries
+    older than ttl) counters, see stats()
+    '''
+
+    def __init__(self, maxsize = 1024, ttl = None):
+
+        from collections import OrderedDict
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # key -> (value, time it was stored)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries)}
+
+
+def normalize_query(search):
+
+    '''
+    Lower cases the search and collapses whitespace so equivalent searches share a cache entry
+    '''
+
+    return ' '.join(search.lower().split())
+
+
+def rank_restaurants(cosine_array, restaurant_index, num_results):
+
+    '''
+    Returns the num_results most similar restaurants as a DataFrame of Similarity sorted from high to low
+    '''
 
-def text_transformer_lsa(preprocessed_texts):
-    
     import pandas as pd
-    Tfidf_vectorizer = pd.read_pickle('Tfidf.pkl')
-    lsa = pd.read_pickle('lsa_model.pkl')
-    
-    vectorized_text = Tfidf_vectorizer.transform(preprocessed_texts)
-    
-    compressed_vector = lsa.transform(vectorized_text)
-    
-    return compressed_vector
 
-def text_transformer_nmf(preprocessed_texts):
-    
+    top_rows = top_k_indices(cosine_array, num_results)
+
+    return pd.DataFrame(cosine_array[top_rows],
+                        index = restaurant_index[top_rows],
+                        columns = ['Similarity'])
+
+
+def rerank_restaurants(cosine_array, features, weight_vector, restaurant_index, num_results):
+
+    '''
+    Scores candidates by Similarity + features @ weight_vector
+
+    OUTPUT: the num_results best candidates as a DataFrame of Similarity and Score, sorted by Score
+    '''
+
     import pandas as pd
-    Tfidf_vectorizer = pd.read_pickle('Tfidf.pkl')
-    nmf = pd.read_pickle('nmf_model.pkl')
-    
-    vectorized_text = Tfidf_vectorizer.transform(preprocessed_texts)
-    
-    compressed_vector = nmf.transform(vectorized_text)
-    
-    return compressed_vector
-
-
-def find_similarity_LSA(search, top_search, location, random = False):
-    
-    import pandas as pd, numpy as np
-    doc_topic_lsa = pd.read_pickle('doc_topic_lsa.pkl')
-    
-    preprocessed_search = preprocessing(search)
-    
-    search_vector = text_transformer_lsa(preprocessed_search)
-    
-    location_res_topic = doc_topic_lsa[doc_topic_lsa['city'] == location].iloc[:,0:10]
-    restaurant_topic_array = location_res_topic.values
-    restaurant_index = location_res_topic.index
-    
-   
-    cosine_list = []
-    
-    from sklearn.metrics.pairwise import cosine_similarity
-    for restaurant in restaurant_topic_array:
-        
-        cosine_list.append(cosine_similarity([restaurant,search_vector.reshape(-1)])[1][0])
-    
-    cosine_array = np.array(cosine_list)
-    
-    restaurant_sim = pd.DataFrame(cosine_array, 
-                                  index = restaurant_index,
-                                 columns = ['Similarity']).sort_values(by = 'Similarity', 
-                                                                       ascending = False)
+
+    score = cosine_array + features @ weight_vector
+    top_rows = top_k_indices(score, num_results)
+
+    return pd.DataFrame({'Similarity': cosine_array[top_rows], 'Score': score[top_rows]},
+                        index = restaurant_index[top_rows])
+
+
+def select_restaurants(ranked, top_search, random = False):
+
+    '''
+    Returns the top_search best of the ranked restaurants, or with random = True
+    top_search restaurants sampled out of the ranked ones (the top_search + 20 best)
+    '''
+
     if random == False:
-        return restaurant_sim[:top_search]
+        return ranked[:top_search].copy()
     else:
-        return restaurant_sim[:top_search+20].sample(top_search)
-
-
-def find_similarity_NMF(search, top_search, location, random = False):
-    
-    import pandas as pd, numpy as np
-    doc_topic_nmf = pd.read_pickle('doc_topic_nmf.pkl')
-    
-    preprocessed_search = preprocessing(search)
-
-    
-    search_vector = text_transformer_nmf(preprocessed_search)
-    
-    location_res_topic = doc_topic_nmf[doc_topic_nmf['city'] == location].iloc[:,0:10]
-    restaurant_topic_array = location_res_topic.values
-    restaurant_index = location_res_topic.index
-    
-    cosine_list = []
-    
-    from sklearn.metrics.pairwise import cosine_similarity
-    for restaurant in restaurant_topic_array:
-        
-        cosine_list.append(cosine_similarity([restaurant,search_vector.reshape(-1)])[1][0])
-    
-    cosine_array = np.array(cosine_list)
-    
-    restaurant_sim = pd.DataFrame(cosine_array, 
-                                  index = restaurant_index,
-                                 columns = ['Similarity']).sort_values(by = 'Similarity', 
-                                                                       ascending = False)
-    
-    if random == False:
-        return restaurant_sim[:top_search]
+        return ranked.sample(min(top_search, len(ranked)))
+
+
+def build_topic_index(doc_topic, num_topics = 10):
+
+    '''
+    INPUT: a doc-topic DataFrame indexed by restaurant name with a city column
+
+    OUTPUT: the per-city partitioned scoring index described in RecommenderEngine.topic_index
+    '''
+
+    import numpy as np
+
+    city = doc_topic['city'].values
+
+    # stable sort so restaurants keep their original order inside each city
+    order = np.argsort(city, kind = 'stable')
+    sorted_city = city[order]
+
+    topic = np.ascontiguousarray(normalize_rows(doc_topic.iloc[:,0:num_topics].values[order]),
+                                 dtype = np.float32)
+
+    # each city occupies one block of rows: city -> (offset, length)
+    names, offsets, lengths = np.unique(sorted_city, return_index = True, return_counts = True)
+    cities = {name: (int(offset), int(length)) for name, offset, length in zip(names, offsets, lengths)}
+
+    return {'topic': topic,
+            'name': doc_topic.index[order],
+            'cities': cities}
+
+
+def save_topic_store(doc_topic, store_dir):
+
+    '''
+    Writes the doc-topic table as a topic store, the on-disk form of the scoring index:
+
+    topic-<version>.npy - float32 unit-length topic vectors grouped by city
+    norm-<version>.npy - float32 length of each original topic vector
+    index.pkl - the restaurant names, the city -> (offset, length) blocks and the version
+
+    Every save writes its arrays under a new version and then swaps index.pkl in with
+    os.replace, so a reader sees either the old or the new store, never a mix of the two.
+    The arrays of the previous version are kept for readers that opened the old index.pkl
+    a moment before the swap; older versions are deleted
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    os.makedirs(store_dir, exist_ok = True)
+
+    index = build_topic_index(doc_topic)
+    order = np.argsort(doc_topic['city'].values, kind = 'stable')
+    norm = np.linalg.norm(doc_topic.iloc[:,0:10].values[order], axis = 1).astype(np.float32)
+
+    index_path = os.path.join(store_dir, 'index.pkl')
+    previous = pd.read_pickle(index_path).get('version') if os.path.exists(index_path) else None
+    version = time.time_ns()
+
+    for file_name, array in [(f'topic-{version}.npy', index['topic']), (f'norm-{version}.npy', norm)]:
+        path = os.path.join(store_dir, file_name)
+        with open(path + '.tmp', 'wb') as fp:
+            np.save(fp, array)
+        os.replace(path + '.tmp', path)
+
+    write_pickle({'name': index['name'], 'cities': index['cities'], 'version': version}, index_path)
+
+    keep = {f'{prefix}-{v}.npy' for prefix in ('topic', 'norm') for v in (version, previous)}
+    for file_name in os.listdir(store_dir):
+        if file_name.endswith('.npy') and file_name not in keep:
+            try:
+                os.remove(os.path.join(store_dir, file_name))
+            except OSError:
+                # still memory-mapped by a reader (Windows); removed by a later save
+                pass
+
+
+def restaurant_features(restaurants, category_columns = (), review_count_scale = None):
+
+    '''
+    INPUT: restaurants with stars, review_count and either the 0/1 category columns from
+    Data_Preprocessing.ipynb or a categories string, the category columns to use
+
+    OUTPUT: (DataFrame of the features, review_count_scale)
+    stars / 5, log(1 + review_count) / review_count_scale (by default the largest log(1 + review_count),
+    so the column is in [0, 1]) and the category flags
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    missing = {'stars', 'review_count'} - set(restaurants.columns)
+    if missing:
+        raise ValueError(f'The restaurants have no {" or ".join(sorted(missing))} column; join them from '
+                         'the business table (yelp_restaurants) by business_id')
+
+    review_count = np.log1p(restaurants['review_count'].values.astype(np.float64))
+    if review_count_scale is None:
+        review_count_scale = float(max(review_count.max(), 1))
+
+    features = pd.DataFrame({'stars': restaurants['stars'].values / 5,
+                             'review_count': review_count / review_count_scale})
+    for column in category_columns:
+        if column in restaurants.columns:
+            features[column] = restaurants[column].values
+        elif 'categories' in restaurants.columns:
+            features[column] = [int(column in (categories or '').split(', ')) for categories in restaurants['categories']]
+        else:
+            raise ValueError(f'The restaurants have neither a {column!r} nor a categories column')
+
+    return features, review_count_scale
+
+
+def save_restaurant_features(yelp_df, doc_topic, category_columns = (), path = 'restaurant_features.pkl'):
+
+    '''
+    INPUT: the restaurant table the doc-topic table was built from (same rows, same order, with
+    stars and review_count joined from the business table, see restaurant_features), the doc-topic table
+
+    Pickles a dense float32 feature array in the row order of the scoring index, together with
+    the restaurant name and city of every row, so the engine can check the rows still line up
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    if len(yelp_df) != len(doc_topic) or not (yelp_df['name'].values == doc_topic.index.values).all():
+        raise ValueError('yelp_df and doc_topic must list the same restaurants in the same order')
+
+    features, review_count_scale = restaurant_features(yelp_df, category_columns)
+
+    # same stable city order as build_topic_index
+    order = np.argsort(doc_topic['city'].values, kind = 'stable')
+
+    write_pickle({'columns': list(features.columns),
+                  'values': np.ascontiguousarray(features.values[order], dtype = np.float32),
+                  'name': doc_topic.index.values[order],
+                  'city': doc_topic['city'].values[order],
+                  'review_count_scale': review_count_scale}, path)
+
+
+def write_pickle(artifact, path):
+
+    '''
+    Pickles the artifact next to path then swaps it in with os.replace,
+    so an engine hot-reloading the file never reads a half written pickle
+    '''
+
+    import pandas as pd
+
+    pd.to_pickle(artifact, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def load_topic_store(store_dir):
+
+    '''
+    Opens a topic store with the topic matrix memory-mapped read only: nothing is copied at startup
+    and every process serving from the same store shares its pages through the OS page cache
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    for attempt in range(3):
+        index = pd.read_pickle(os.path.join(store_dir, 'index.pkl'))
+        # stores written before versioning have a single topic.npy / norm.npy
+        suffix = f'-{index["version"]}' if 'version' in index else ''
+        try:
+            index['topic'] = np.load(os.path.join(store_dir, f'topic{suffix}.npy'), mmap_mode = 'r')
+            index['norm'] = np.load(os.path.join(store_dir, f'norm{suffix}.npy'), mmap_mode = 'r')
+        except FileNotFoundError:
+            # two saves went by since index.pkl was read; read the current one
+            if attempt == 2:
+                raise
+            continue
+
+        return index
+
+
+def topic_store_to_doc_topic(store_dir):
+
+    '''
+    Rebuilds a doc-topic DataFrame (grouped by city, float32) from a topic store
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    index = load_topic_store(store_dir)
+
+    doc_topic = pd.DataFrame(np.asarray(index['topic']) * np.asarray(index['norm'])[:, None],
+                             index = index['name'])
+    doc_topic['city'] = np.repeat(list(index['cities']), [length for offset, length in index['cities'].values()])
+
+    return doc_topic
+
+
+def names_digest(names):
+
+    '''
+    SHA-1 of a sequence of restaurant names, to tell whether an artifact was built over the same
+    restaurants in the same order as the scoring index
+    '''
+
+    import hashlib
+
+    digest = hashlib.sha1()
+    for name in names:
+        digest.update(str(name).encode('utf-8') + b'\0')
+
+    return digest.hexdigest()
+
+
+def normalize_rows(matrix):
+
+    '''
+    Scales each row of the matrix to unit length; all-zero rows stay zero (as in cosine_similarity)
+    '''
+
+    import numpy as np
+
+    matrix = np.atleast_2d(np.asarray(matrix, dtype = np.float64))
+    norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+
+    '''
+    Returns the positions of the k highest scores, ordered from highest to lowest,
+    without sorting the whole array
+    '''
+
+    import numpy as np
+
+    k = min(max(k, 0), len(scores))
+    if k == 0:
+        return np.array([], dtype = np.intp)
+
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
     else:
-        return restaurant_sim[:top_search+20].sample(top_search)
+        top = np.arange(len(scores))
+
+    return top[np.argsort(-scores[top], kind = 'stable')]
+
+
+# receives the stage timings and counters; None (the default) turns instrumentation off
+_metrics_sink = None
+
+
+def set_metrics_sink(sink):
+
+    '''
+    Installs the sink of stage timings and counters, e.g. metrics.LoggingSink() or
+    metrics.MetricsRegistry(); None turns instrumentation off again
+    '''
+
+    global _metrics_sink
+    _metrics_sink = sink
+
+
+class _StageTimer:
+
+    __slots__ = ('sink', 'stage', 'start')
+
+    def __init__(self, sink, stage):
+        self.sink = sink
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.sink.observe(self.stage, time.perf_counter() - self.start)
+
+
+class _NoTimer:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_timer = _NoTimer()
+
+
+def timed_stage(stage):
+
+    '''
+    Context manager timing a stage into the metrics sink; a shared no-op when there is no sink
+    '''
+
+    sink = _metrics_sink
+    if sink is None:
+        return _no_timer
+
+    return _StageTimer(sink, stage)
+
+
+def count_event(name, amount = 1):
+
+    sink = _metrics_sink
+    if sink is not None:
+        sink.increment(name, amount)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(artifact_dir = '.'):
+
+    '''
+    Returns the process-wide RecommenderEngine, creating it on first use
+    '''
+
+    global _engine
+
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RecommenderEngine(artifact_dir)
+
+    return _engine
+
+
+# token -> stem memo shared by every query, bounded to TOKEN_CACHE_SIZE entries
+TOKEN_CACHE_SIZE = 50000
+_token_cache = {}
+_stemmers = None
+
+
+def load_stemmers():
+
+    '''
+    Returns the (WordNetLemmatizer, PorterStemmer) pair, creating it and
+    loading the WordNet corpus on the first call
+    '''
+
+    global _stemmers
+
+    if _stemmers is None:
+        from nltk.stem import WordNetLemmatizer, PorterStemmer
+
+        lemmatizer = WordNetLemmatizer()
+        # WordNet is loaded lazily on the first lookup; do it now rather than inside a request
+        lemmatizer.lemmatize('restaurants')
+        _stemmers = (lemmatizer, PorterStemmer())
+
+    return _stemmers
+
+
+def stem_token(token):
+
+    '''
+    Lemmatizes then stems a single token, the same way model_training.ipynb built Tfidf.pkl
+    '''
+
+    stem = _token_cache.get(token)
+
+    if stem is None:
+        lemmatizer, stemmer = load_stemmers()
+        stem = stemmer.stem(lemmatizer.lemmatize(token))
+
+        if len(_token_cache) >= TOKEN_CACHE_SIZE:
+            # drop the oldest entry (dicts keep insertion order)
+            _token_cache.pop(next(iter(_token_cache)), None)
+        _token_cache[token] = stem
+
+    return stem
+
+
+def preprocessing(texts):
+
+    '''
+    Splits the search into words and lemmatizes + stems each of them
+
+    RETURN: a one element list holding the preprocessed search, ready for Tfidf_vectorizer.transform
+    '''
+
+    return [' '.join([stem_token(w) for w in texts.split()])]
+
+
+def text_transformer_lsa(preprocessed_texts):
+
+    return get_engine().transform(preprocessed_texts, 'lsa')
+
+def text_transformer_nmf(preprocessed_texts):
+
+    return get_engine().transform(preprocessed_texts, 'nmf')
+
+
+def find_similarity_LSA(search, top_search, location, random = False, nprobe = None, weights = None):
+
+    return get_engine().find_similarity(search, top_search, location, 'lsa', random, nprobe, weights)
+
+
+def find_similarity_NMF(search, top_search, location, random = False, nprobe = None, weights = None):
+
+    return get_engine().find_similarity(search, top_search, location, 'nmf', random, nprobe, weights)
+
+
+def find_similarity_LSA_batch(queries, random = False):
+
+    return get_engine().find_similarity_batch(queries, 'lsa', random)
+
+
+def find_similarity_NMF_batch(queries, random = False):
 
+    return get_engine().find_similarity_batch(queries, 'nmf', random)
@@ -0,0 +1,253 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from help_function import (build_topic_index, get_engine, preprocessing, restaurant_features, save_topic_store,
+                           topic_store_to_doc_topic, write_pickle)
+
+
+def explained_fraction(vectorized_text, topic_vectors, model):
+
+    '''
+    Share of each document's TF-IDF norm that the topic model reconstructs:
+    1 - ||x - t H||^2 / ||x||^2 for document x, topic vector t and components H.
+    Computed without building the dense reconstruction
+    '''
+
+    components = model.components_
+
+    x_norm = np.asarray(vectorized_text.multiply(vectorized_text).sum(axis = 1)).ravel()
+    cross = np.einsum('ij,ij->i', np.asarray(vectorized_text @ components.T), topic_vectors)
+    recon_norm = np.einsum('ij,jk,ik->i', topic_vectors, components @ components.T, topic_vectors)
+
+    error = x_norm - 2 * cross + recon_norm
+    x_norm[x_norm == 0] = 1
+
+    return 1 - error / x_norm
+
+
+def project_restaurants(restaurants, model = 'lsa', engine = None):
+
+    '''
+    INPUT: a DataFrame of new or changed restaurants with name, city and text
+    (all reviews of the restaurant, as in yelp_df)
+
+    OUTPUT: (rows in the doc_topic_<model>.pkl layout, explained fraction of each restaurant)
+
+    The reviews go through the same preprocessing, Tfidf.pkl and topic model as the search queries.
+    Restaurants without reviews (text = None, as export_yelp writes them) have nothing to project
+    and raise a ValueError
+    '''
+
+    no_text = restaurants['text'].isna().values
+    if no_text.any():
+        raise ValueError(f'{no_text.sum()} restaurants have no review text '
+                         f'({", ".join(map(str, restaurants["name"].values[no_text][:5]))}); '
+                         "drop them first, e.g. restaurants[restaurants['text'].notna()]")
+
+    engine = engine or get_engine()
+
+    preprocessed_reviews = [preprocessing(review)[0] for review in restaurants['text']]
+    vectorized_text = engine.get('tfidf').transform(preprocessed_reviews)
+    topic_model = engine.get(model)
+    topic_vectors = topic_model.transform(vectorized_text)
+
+    doc_topic = pd.DataFrame(topic_vectors, index = pd.Index(restaurants['name'].values, name = 'name'))
+    doc_topic['city'] = restaurants['city'].values
+
+    return doc_topic, explained_fraction(vectorized_text, topic_vectors, topic_model)
+
+
+def kept_rows(doc_topic, new_rows):
+
+    '''
+    Boolean mask of the rows of doc_topic whose (name, city) is not in new_rows
+    '''
+
+    new_keys = pd.MultiIndex.from_arrays([new_rows.index, new_rows['city']])
+    old_keys = pd.MultiIndex.from_arrays([doc_topic.index, doc_topic['city']])
+
+    return ~old_keys.isin(new_keys)
+
+
+def upsert_doc_topic(doc_topic, new_rows):
+
+    '''
+    Replaces the rows of every (name, city) in new_rows and appends the rest.
+    Restaurant names are not unique, so all existing rows sharing a (name, city) are replaced
+    '''
+
+    return pd.concat([doc_topic[kept_rows(doc_topic, new_rows)], new_rows[doc_topic.columns]])
+
+
+def upsert_restaurant_features(features, doc_topic, new_rows, restaurants):
+
+    '''
+    INPUT: the restaurant_features.pkl dict of doc_topic (the table before the upsert), the projected
+    new_rows and the restaurants they came from (with stars and review_count, see restaurant_features)
+
+    OUTPUT: the features dict of upsert_doc_topic(doc_topic, new_rows), in the row order of its
+    scoring index, or None when the old features do not line up with doc_topic
+    '''
+
+    order = np.argsort(doc_topic['city'].values, kind = 'stable')
+    if 'name' not in features or not np.array_equal(features['name'], doc_topic.index.values[order]):
+        return None
+
+    # back to the row order of doc_topic, so the rows can be dropped and appended like upsert_doc_topic does
+    values = np.empty_like(features['values'])
+    values[order] = features['values']
+
+    new_values = restaurant_features(restaurants, features['columns'][2:], features['review_count_scale'])[0]
+    values = np.concatenate([values[kept_rows(doc_topic, new_rows)],
+                             new_values[features['columns']].values.astype(np.float32)])
+
+    doc_topic = upsert_doc_topic(doc_topic, new_rows)
+    order = np.argsort(doc_topic['city'].values, kind = 'stable')
+
+    return dict(features,
+                values = np.ascontiguousarray(values[order]),
+                name = doc_topic.index.values[order],
+                city = doc_topic['city'].values[order])
+
+
+def upsert_ann_index(ann_index, doc_topic, cities, **kwargs):
+
+    '''
+    Rebuilds the IVF index of every city in cities over the blocks of the upserted doc_topic.
+    The blocks of the other cities are unchanged, so their indexes are kept.
+    A rebuilt city keeps its # of clusters unless kwargs sets num_clusters
+    '''
+
+    from ann_index import build_ivf
+
+    index = build_topic_index(doc_topic)
+
+    ann_index = dict(ann_index)
+    for city in cities:
+        offset, length = index['cities'][city]
+        options = dict(kwargs)
+        if city in ann_index:
+            options.setdefault('num_clusters', len(ann_index[city]['centroids']))
+        ann_index[city] = build_ivf(index['topic'][offset:offset + length],
+                                    names = index['name'][offset:offset + length], **options)
+
+    return ann_index
+
+
+class DriftTracker:
+
+    '''
+    Tracks how well the frozen Tfidf + topic model explains newly ingested restaurants,
+    persisted as drift_<model>.json next to the pickles
+
+    A full refit is due when the mean explained fraction of the last `window` ingested
+    restaurants falls more than `tolerance` below the baseline measured on training reviews,
+    or when more than `max_new_share` of the table was ingested since the last fit
+    '''
+
+    def __init__(self, path, tolerance = 0.1, window = 500, max_new_share = 0.2):
+
+        self.path = path
+        self.tolerance = tolerance
+        self.window = window
+        self.max_new_share = max_new_share
+
+        self.state = {'baseline': None, 'recent': [], 'ingested': 0}
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.state.update(json.load(fp))
+
+    def set_baseline(self, reference_restaurants, model = 'lsa', engine = None):
+
+        '''
+        Measures the baseline on restaurants the models were trained on (name, city, text)
+        '''
+
+        fractions = project_restaurants(reference_restaurants, model, engine)[1]
+        self.state.update(baseline = float(np.mean(fractions)), recent = [], ingested = 0)
+        self.save()
+
+    def update(self, fractions):
+
+        self.state['recent'] = (self.state['recent'] + [float(f) for f in fractions])[-self.window:]
+        self.state['ingested'] += len(fractions)
+        self.save()
+
+    def needs_refit(self, table_size):
+
+        if self.state['ingested'] > self.max_new_share * table_size:
+            return True
+
+        baseline = self.state['baseline']
+        if baseline is None or not self.state['recent']:
+            return False
+
+        return np.mean(self.state['recent']) < baseline - self.tolerance
+
+    def save(self):
+
+        with open(self.path + '.tmp', 'w') as fp:
+            json.dump(self.state, fp)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def ingest_restaurants(restaurants, model = 'lsa', engine = None, tracker = None):
+
+    '''
+    Projects new or changed restaurants through the existing Tfidf.pkl and topic model,
+    upserts them into doc_topic_<model>.pkl and/or the doc_topic_<model>/ topic store,
+    rebuilds the IVF index of the touched cities in ivf_<model>.pkl and the rows of
+    restaurant_features.pkl, and hot-reloads the engine
+
+    restaurant_features.pkl is deleted instead when the restaurants have no stars or
+    review_count column (or it no longer lines up with the table), rerun save_restaurant_features then
+
+    RETURN: True when the drift tracker says a full refit in model_training.ipynb is due
+    '''
+
+    engine = engine or get_engine()
+    if tracker is None:
+        tracker = DriftTracker(os.path.join(engine.artifact_dir, f'drift_{model}.json'))
+
+    new_rows, fractions = project_restaurants(restaurants, model, engine)
+
+    pickle_path = engine.artifact_path('doc_topic_' + model)
+    store_dir = os.path.dirname(engine.artifact_path('topic_store_' + model))
+    has_store = os.path.exists(os.path.join(store_dir, 'index.pkl'))
+
+    # the engine scores from the topic store when there is one
+    if has_store:
+        old_doc_topic = topic_store_to_doc_topic(store_dir)
+    else:
+        old_doc_topic = engine.get('doc_topic_' + model)
+    doc_topic = upsert_doc_topic(old_doc_topic, new_rows)
+
+    if os.path.exists(pickle_path):
+        write_pickle(doc_topic, pickle_path)
+    if has_store:
+        save_topic_store(doc_topic, store_dir)
+
+    ivf_path = engine.artifact_path('ivf_' + model)
+    if os.path.exists(ivf_path):
+        write_pickle(upsert_ann_index(pd.read_pickle(ivf_path), doc_topic, set(new_rows['city'])), ivf_path)
+
+    features_path = engine.artifact_path('features')
+    if os.path.exists(features_path):
+        try:
+            features = upsert_restaurant_features(pd.read_pickle(features_path), old_doc_topic,
+                                                  new_rows, restaurants)
+        except ValueError:
+            features = None
+        if features is None:
+            os.remove(features_path)
+        else:
+            write_pickle(features, features_path)
+
+    engine.reload_if_changed(force = True)
+
+    tracker.update(fractions)
+
+    return tracker.needs_refit(len(doc_topic))
@@ -0,0 +1,106 @@
+'''
+Sinks for the recommender's stage timings and counters, installed with
+help_function.set_metrics_sink(sink). A sink implements
+
+observe(stage, seconds) - one timing of a stage
+increment(name, amount) - a counter increment
+'''
+
+import logging
+import threading
+
+
+class LoggingSink:
+
+    '''
+    Logs every timing and counter increment (meant for debugging, one line per event)
+    '''
+
+    def __init__(self, logger = None, level = logging.DEBUG):
+
+        self.logger = logger or logging.getLogger('recommender.metrics')
+        self.level = level
+
+    def observe(self, stage, seconds):
+        self.logger.log(self.level, 'stage %s took %.3f ms', stage, seconds * 1000)
+
+    def increment(self, name, amount = 1):
+        self.logger.log(self.level, 'counter %s += %s', name, amount)
+
+
+# histogram bucket upper bounds in seconds, from 50 microseconds to 5 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class MetricsRegistry:
+
+    '''
+    In-process registry of counters and per-stage latency histograms,
+    rendered in the Prometheus text format by render()
+    '''
+
+    def __init__(self, buckets = DEFAULT_BUCKETS, prefix = 'recommender'):
+
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+
+        self.counters = {}
+        # stage -> [count per bucket (+Inf last), sum of seconds, count]
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+
+        import bisect
+
+        position = bisect.bisect_left(self.buckets, seconds)
+
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][position] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def increment(self, name, amount = 1):
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+
+        '''
+        Returns {'counters': {...}, 'stages': {stage: {'count', 'sum_seconds', 'buckets'}}}
+        '''
+
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'stages': {stage: {'count': count,
+                                       'sum_seconds': total,
+                                       'buckets': dict(zip(self.buckets + (float('inf'),), bucket_counts))}
+                               for stage, (bucket_counts, total, count) in self.histograms.items()}}
+
+    def render(self):
+
+        lines = []
+        snapshot = self.snapshot()
+
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'# TYPE {self.prefix}_{name}_total counter')
+            lines.append(f'{self.prefix}_{name}_total {value}')
+
+        histogram_name = f'{self.prefix}_stage_seconds'
+        if snapshot['stages']:
+            lines.append(f'# TYPE {histogram_name} histogram')
+        for stage, histogram in sorted(snapshot['stages'].items()):
+            cumulative = 0
+            for bound, bucket_count in histogram['buckets'].items():
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{histogram_name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{histogram_name}_sum{{stage="{stage}"}} {histogram["sum_seconds"]}')
+            lines.append(f'{histogram_name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,106 @@
+import gc
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import help_function
+
+
+def _init_worker(artifact_dir, models):
+
+    import numpy as np
+
+    # forked workers already hold the parent's warm engine; spawned ones load their own
+    help_function.get_engine(artifact_dir).warm_up(models)
+
+    # forked workers would otherwise all draw the same random = True samples
+    np.random.seed()
+
+
+def _find_similarity(search, top_search, location, model, random, nprobe, weights, candidates):
+    return help_function.get_engine().find_similarity(search, top_search, location, model, random, nprobe,
+                                                      weights, candidates)
+
+
+def _find_similarity_batch(queries, model, random):
+    return help_function.get_engine().find_similarity_batch(queries, model, random)
+
+
+class RecommenderPool:
+
+    '''
+    Serves recommender queries from `workers` processes so the CPU bound Tfidf/SVD transforms
+    run on every core
+
+    The parent loads the vectorizer and topic models once, freezes them out of the garbage
+    collector and forks the workers: the unpickled objects are shared copy-on-write instead of
+    each worker holding its own copy, and topic stores (doc_topic_<model>/) are memory-mapped,
+    so their pages are shared through the page cache. Where fork is not available the workers
+    start with spawn and load the artifacts themselves (the topic stores are still shared)
+
+    Copy-on-write only keeps pages shared while nobody writes to them. The QueryProjector that
+    serves single searches keeps the vocabulary and its matrices in flat numpy buffers, which
+    lookups only read. The Tfidf vectorizer's vocabulary_ dict is not moved out of Python objects:
+    batches of more than 16 searches go through vectorizer.transform, whose dict lookups write
+    the refcounts of the terms they touch, so a worker serving large batches slowly copies the
+    dict's pages into private memory
+    '''
+
+    def __init__(self, workers = None, artifact_dir = '.', models = ('lsa', 'nmf')):
+
+        self.workers = workers or os.cpu_count()
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+
+            help_function.get_engine(artifact_dir).warm_up(models)
+            # move everything loaded so far to a permanent generation, so collections in the
+            # workers do not write to (and copy) the shared pages
+            gc.freeze()
+        else:
+            context = multiprocessing.get_context('spawn')
+
+        self._executor = ProcessPoolExecutor(self.workers, mp_context = context,
+                                             initializer = _init_worker, initargs = (artifact_dir, models))
+
+    def submit(self, search, top_search, location, model = 'lsa', random = False, nprobe = None,
+               weights = None, candidates = 200):
+
+        '''
+        Dispatches one query to a worker; returns a Future of the ranked DataFrame
+        (see RecommenderEngine.find_similarity for nprobe, weights and candidates)
+        '''
+
+        return self._executor.submit(_find_similarity, search, top_search, location, model, random, nprobe,
+                                     weights, candidates)
+
+    def find_similarity(self, search, top_search, location, model = 'lsa', random = False, nprobe = None,
+                        weights = None, candidates = 200):
+        return self.submit(search, top_search, location, model, random, nprobe, weights, candidates).result()
+
+    def find_similarity_batch(self, queries, model = 'lsa', random = False):
+
+        '''
+        Splits a list of (search, location, top_search) tuples into one chunk per worker
+        and runs find_similarity_batch on each chunk in parallel
+        '''
+
+        if len(queries) == 0:
+            return []
+
+        chunk_size = -(-len(queries) // self.workers)
+        futures = [self._executor.submit(_find_similarity_batch, queries[start:start + chunk_size], model, random)
+                   for start in range(0, len(queries), chunk_size)]
+
+        return [result for future in futures for result in future.result()]
+
+    def close(self):
+
+        self._executor.shutdown()
+        gc.unfreeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()